@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+import os
+import sys
+
+import django
+from django.conf import settings
+from django.test.utils import get_runner
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:0] = [os.path.join(base_dir, 'src'), base_dir]
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    django.setup()
+
+    test_runner = get_runner(settings)()
+    failures = test_runner.run_tests(sys.argv[1:] or ['tests'])
+    sys.exit(bool(failures))
+
+
+if __name__ == '__main__':
+    main()
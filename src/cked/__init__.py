@@ -1,3 +1,7 @@
+import django
 
 VERSION = (2, 0, 2)
-__version__ = ".".join(str(i) for i in VERSION)
\ No newline at end of file
+__version__ = ".".join(str(i) for i in VERSION)
+
+if django.VERSION < (3, 2):
+    default_app_config = 'cked.apps.CkedConfig'
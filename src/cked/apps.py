@@ -0,0 +1,33 @@
+import threading
+
+from django.apps import AppConfig
+from django.core.signals import setting_changed
+
+
+class CkedConfig(AppConfig):
+    name = 'cked'
+    verbose_name = 'CKEd'
+
+    def ready(self):
+        self._connector = None
+        self._lock = threading.Lock()
+        # the connector is built by the first request, not here: it touches the file system, which management
+        # commands do not need, and opens SQLite databases, which must not be inherited by forked workers
+        setting_changed.connect(self._setting_changed)
+
+    def get_connector(self):
+        """ Return connector compiled from ELFINDER_OPTIONS, shared by all requests. """
+        connector = self._connector
+        if connector is None:
+            from .views import build_connector
+
+            with self._lock:
+                if self._connector is None:
+                    self._connector = build_connector()
+                connector = self._connector
+        return connector
+
+    def _setting_changed(self, setting, **kwargs):
+        if setting in ('ELFINDER_OPTIONS', 'SECRET_KEY', 'CACHES'):
+            with self._lock:
+                self._connector = None
@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .utils import make_hash
+
+
+class ListingCache:
+    """ In-process LRU in front of an optional shared cache backend (e.g. Django cache). """
+
+    def __init__(self, backend=None, size: int = 256, timeout: int = 300, prefix: str = 'cked:listing:') -> None:
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._items: OrderedDict = OrderedDict()
+
+    def make_key(self, *parts: Any) -> str:
+        return f"{self.prefix}{make_hash(repr(parts))}"
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._items:
+                expires, value = self._items[key]
+                if expires > time.monotonic():
+                    self._items.move_to_end(key)
+                    return value
+                del self._items[key]
+
+        if self.backend is None:
+            return None
+
+        value = self.backend.get(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._remember(key, value)
+        if self.backend is not None:
+            self.backend.set(key, value, self.timeout)
+
+    def _remember(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.timeout, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_caches: Dict[str, ListingCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_listing_cache(name: str, backend=None, size: int = 256, timeout: int = 300) -> ListingCache:
+    """ Return process wide listing cache registered under name. """
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = ListingCache(backend, size, timeout)
+        return _caches[name]
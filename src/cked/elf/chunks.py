@@ -0,0 +1,144 @@
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+chunk_re = re.compile(r'^(?P<name>.+)\.(?P<index>\d+)_(?P<last>\d+)\.part$')
+
+
+def parse_chunk(value: str) -> Optional[Tuple[str, int, int]]:
+    """ Parse elFinder chunk name 'file.ext.{index}_{last index}.part' into (name, index, number of chunks). """
+    match = chunk_re.match(value or '')
+    if not match:
+        return None
+    index, last = int(match.group('index')), int(match.group('last'))
+    if index > last:
+        return None
+    return match.group('name'), index, last + 1
+
+
+def parse_range(value: str) -> Optional[Tuple[int, int, int]]:
+    """ Parse 'start,length,total' byte range of a chunk. """
+    try:
+        start, length, total = (int(part) for part in (value or '').split(','))
+    except ValueError:
+        return None
+    if start < 0 or length < 0 or start + length > total:
+        return None
+    return start, length, total
+
+
+class ChunkedUpload:
+    """
+    File assembled from chunks which may arrive in any order and in parallel. Chunks are written in place
+    with pwrite; an empty marker file per chunk records what was received, so the upload can be resumed.
+    """
+
+    def __init__(self, base: Path, key: str, count: int, total: int) -> None:
+        self.dir = Path(base).joinpath(key)
+        self.data = self.dir.joinpath('data')
+        self.count = count
+        self.total = total
+
+    def write(self, index: int, start: int, src: BinaryIO, length: int, buf_size: int = 1024 * 1024) -> bool:
+        """ Store chunk, return False if the data does not have the announced length. """
+        self.dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.data, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            written = 0
+            while written < length:
+                buf = src.read(min(buf_size, length - written))
+                if not buf:
+                    break
+                os.pwrite(fd, buf, start + written)
+                written += len(buf)
+            if written != length or src.read(1):
+                return False
+        finally:
+            os.close(fd)
+
+        self.dir.joinpath(str(index)).touch()
+        return True
+
+    def received(self) -> List[int]:
+        """ Return indexes of stored chunks. """
+        try:
+            return sorted(int(name) for name in os.listdir(self.dir) if name.isdigit())
+        except FileNotFoundError:
+            return []
+
+    def assemble(self, dest: Path, mode: int) -> bool:
+        """
+        Move assembled file to dest. Return False if another request does it, raise ValueError if the chunks
+        do not add up to the announced size.
+        """
+        merging = self.dir.joinpath('merging')
+        try:
+            # only one of the requests which completed the upload gets here
+            os.rename(self.data, merging)
+        except FileNotFoundError:
+            return False
+
+        try:
+            if merging.stat().st_size != self.total:
+                raise ValueError(f"assembled {merging.stat().st_size} of {self.total} bytes")
+            merging.chmod(mode)
+            os.replace(merging, dest)
+            return True
+        finally:
+            self.discard()
+
+    def discard(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def purge_stale(base: Path, max_age: int) -> None:
+    """ Remove uploads and temporary files which were not touched for max_age seconds. """
+    limit = time.time() - max_age
+    try:
+        with os.scandir(base) as it:
+            for entry in it:
+                try:
+                    if entry.stat(follow_symlinks=False).st_mtime >= limit:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.unlink(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+
+
+class UploadBudget:
+    """ Bytes an upload request may still store, shared by the workers saving its files. """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self, size: int) -> bool:
+        """ Account size, return False without taking anything if it does not fit. """
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+
+_pools: Dict[int, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def get_upload_pool(workers: int) -> ThreadPoolExecutor:
+    """ Return process wide pool storing uploaded files. """
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cked-upload')
+        return _pools[workers]
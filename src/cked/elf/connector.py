@@ -1,20 +1,87 @@
 
 import re
+from contextvars import Context, ContextVar, copy_context
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Union, Tuple, Optional
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Union, Tuple, Optional
 from urllib.parse import quote, urljoin
+import copy
+import hashlib
 import mimetypes
 import os
-import shutil
+import sqlite3
 import time
 import traceback
 
+from .cache import ListingCache
+from .chunks import ChunkedUpload, UploadBudget, get_upload_pool, parse_chunk, parse_range, purge_stale
 from .const import *
-from .utils import crop_tuple, exception_to_string, make_hash, make_unique_name, read_link
+from .copier import copy_file, copy_tree, get_copy_pool
+from .dedup import BlobStore, file_digest
+from .images import DimensionCache, read_image_size
+from .index import Index
+from .jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JobProgress, JobStore, count_files, current_job, get_job_pool
+from .stream import Entry, iter_json
+from .thumbs import ensure_thumbnail, get_scheduler, make_thumbnail, resize_image, thumbnail_path
+from .utils import (
+    content_disposition, decode_path_id, encode_path_id, exception_to_string, is_hash, make_hash, make_unique_name, natural_key,
+    read_link
+)
+
+
+class RequestState:
+    """ Variables of one request handled by a connector. """
+
+    __slots__ = (
+        'connector', 'http_status_code', 'http_header', '_request', '_response', '_error_data', '_form',
+        '_index_rebuilt', '_stats', '_access', '_dims_dirs', '_time', '_today', '_yesterday',
+    )
+
+    def __init__(self, connector: 'Connector') -> None:
+        self.connector = connector
+        self.http_status_code = 0
+        self.http_header = {}
+        self._request = {}
+        self._response = {RSP_DEBUG: {}}
+        self._error_data = {}
+        self._form = {}
+        self._index_rebuilt = False
+        self._stats = {}
+        self._access = {}
+        self._dims_dirs = {}
+
+        self._time = time.time()
+        t = datetime.fromtimestamp(self._time)
+        self._today = time.mktime(datetime(t.year, t.month, t.day).timetuple())
+        self._yesterday = self._today - 86400
+
+
+# state of the request being handled in the current thread or task
+_request_state: ContextVar[Optional[RequestState]] = ContextVar('cked_request_state', default=None)
+
+
+class _PerRequest:
+    """ Connector attribute kept in the state of the current request. """
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(instance._state, self.name)
+
+    def __set__(self, instance, value) -> None:
+        setattr(instance._state, self.name, value)
 
 
 class Connector:
+    """
+    elFinder connector. Configuration is fixed when the connector is created, everything a command changes lives
+    in the state of the current request, so one instance can serve concurrent requests.
+    """
+
     _options = {
 
         'URL': '',
@@ -23,6 +90,7 @@ class Connector:
             'create': {},
             'extract': {}
         },
+        'copyWorkers': 4,
         'defaults': {
             'read': True,
             'write': True,
@@ -31,16 +99,40 @@ class Connector:
         'disabled': [],
         'debug': False,
         'dotFiles': False,
+        'dedup': False,
+        'dedupDir': '.blobs',
         'dirSize': True,
+        'streamListing': False,
         'fileURL': True,
+        'hashMode': 'md5',
+        'hashSecret': '',
         'imgLib': 'auto',
+        'lazyTree': False,
+        'index': '.elfinder.sqlite3',
+        'indexRebuildInterval': 300,
+        'jobs': False,
+        'jobsFile': '.elfinder-jobs.sqlite3',
+        'jobsTimeout': 86400,
+        'jobsWorkers': 2,
         'perms': {},
+        'resample': 'lanczos',
         'root': '',
         'rootAlias': 'Home',
         'tmbAtOnce': 5,
+        'tmbBackground': False,
+        'tmbWorkers': 2,
         'tmbDir': '.tmb',
+        'tmbFormat': 'png',
+        'tmbOnDemand': False,
+        'tmbURL': '',
         'tmbSize': 48,
         'uploadMaxSize': 256,
+        'uploadChunkDir': '.chunks',
+        'uploadChunkTimeout': 86400,
+        'uploadWorkers': 4,
+        'uploadImageProcess': False,
+        'uploadImageMaxSize': 0,
+        'uploadImageQuality': 85,
         'uploadWriteChunk': 8192,
         'uploadAllow': [],
         'uploadDeny': [],
@@ -58,11 +150,19 @@ class Connector:
         'duplicate': '_cmd_duplicate',
         'resize': '_cmd_resize',
         'tmb': '_cmd_thumbnails',
+        'tree': '_cmd_tree',
         'read': '_cmd_read',
         'edit': '_cmd_edit',
         'ping': '_cmd_ping',
+        'status': '_cmd_status',
     }
 
+    # commands which modify files, they invalidate listings
+    _mutating_commands = ('rename', 'mkdir', 'mkfile', 'rm', 'paste', 'upload', 'duplicate', 'resize', 'edit')
+
+    # commands run as background jobs with the jobs option
+    _job_commands = ('rm', 'paste', 'duplicate')
+
     _mimeType_list = {
         # text
         'txt': 'text/plain',
@@ -97,77 +197,149 @@ class Connector:
 
     http_allowed_params = (
         API_CMD, API_CONTENT, API_CURRENT, API_CUT,  API_DEST, API_INIT, API_HEIGHT, API_NAME, API_SRC, API_TARGET,
-        API_TARGETS, API_TREE, API_TYPE, API_UPLOAD, API_WIDTH,
+        API_TARGETS, API_TREE, API_TYPE, API_UPLOAD, API_WIDTH, API_OFFSET, API_LIMIT, API_SORT, API_ORDER,
+        API_CHUNK, API_CID, API_RANGE, API_JOB,
     )
-    http_status_code = 0
-    http_header = {}
+
+    _sort_keys = ('name', 'date', 'size', 'kind')
     http_response = None
 
-    _time = 0
-    _request: Dict = {}
-    _response = {
-        RSP_DEBUG: {},
-    }
-    _error_data: Dict = {}
-    _form = {}
+    http_status_code = _PerRequest()
+    http_header = _PerRequest()
+    _request = _PerRequest()
+    _response = _PerRequest()
+    _error_data = _PerRequest()
+    _form = _PerRequest()
+    _index_rebuilt = _PerRequest()
+    _stats = _PerRequest()
+    _access = _PerRequest()
+    _dims_dirs = _PerRequest()
+    _time = _PerRequest()
+    _today = _PerRequest()
+    _yesterday = _PerRequest()
+
+    _blobs = None
+    _jobs = None
+    _dims = None
     _im = None
+    _index = None
     _sp = None
-    _today = 0
-    _yesterday = 0
 
-    def __init__(self, opts: dict) -> None:
-        for option, value in opts.items():
-            self._options[option] = value
+    def __init__(self, opts: dict, listing_cache: Optional[ListingCache] = None) -> None:
+        options = copy.deepcopy(self._options)
+        options.update(opts)
+
+        self._listing_cache = listing_cache
 
-        # print(self._options)
-        self._options['URL'] = self._check_utf8(self._options['URL']).rstrip('/')
+        # print(options)
+        options['URL'] = self._check_utf8(options['URL']).rstrip('/')
 
         # relative url to MEDIA should start with '/'
-        if not self._options['URL'].startswith('/'):
-            self._options['URL'] = f"/{self._options['URL']}"
+        if not options['URL'].startswith('/'):
+            options['URL'] = f"/{options['URL']}"
 
-        self._options['root'] = self._check_utf8(self._options['root'])
+        options['root'] = self._check_utf8(options['root'])
 
-        root_path = Path(self._options['root'])
+        self._path_ids = options['hashMode'] == 'path'
+        if self._path_ids and not options['hashSecret']:
+            raise ValueError("'hashSecret' option is required when 'hashMode' is 'path'")
+        if options['tmbOnDemand'] and not options['index'] and not self._path_ids:
+            # the thumbnail view resolves md5 hashes only through the index
+            raise ValueError("'tmbOnDemand' option requires the index or 'hashMode' 'path'")
+
+        root_path = Path(options['root'])
         if not root_path.exists():
             root_path.mkdir()
 
-        self._debug('URL', self._options['URL'])
-        self._debug('root', self._options['root'])
-
-        for cmd in self._options['disabled']:
-            if cmd in self._commands:
-                del self._commands[cmd]
+        self._commands = MappingProxyType(
+            {cmd: method for cmd, method in self._commands.items() if cmd not in options['disabled']}
+        )
 
-        if self._options['tmbDir']:
-            self._options['tmbDir'] = Path(self._options['root']).joinpath(self._options['tmbDir'])
-            tmp_path = Path(self._options['tmbDir'])
+        if options['tmbDir']:
+            tmp_path = Path(options['root']).joinpath(options['tmbDir'])
             try:
                 if not tmp_path.exists():
                     tmp_path.mkdir()
-                self._options['tmbDir'] = tmp_path
+                options['tmbDir'] = tmp_path
             except PermissionError:
-                self._options['tmbDir'] = False
-                self._debug("thumbnail", f"Permission denied: {tmp_path}")
+                options['tmbDir'] = False
                 print(f"WARNING: failed to create thumbnail folder at {tmp_path}, "
                       f"due to permission denied, it will be disabled.")
 
-    def __reset(self):
-        """ Flush per request variables """
-        # self.httpStatusCode = 0
-        # self.httpHeader = {}
-        # self.httpResponse = None
-        self._request: Dict = {}
-        self._response: Dict = {}
-        self._errorData = {}
-        self._form = {}
+        if options['imgLib'] is not False:
+            try:
+                from PIL import Image
+                # load the common image plugins now instead of on the first thumbnail
+                Image.preinit()
+                self._im = Image
+                options['imgLib'] = 'PIL'
+            except ImportError:
+                self._im = False
+                options['imgLib'] = False
 
-        self._time = time.time()
-        t = datetime.fromtimestamp(self._time)
-        self._today = time.mktime(datetime(t.year, t.month, t.day).timetuple())
-        self._yesterday = self._today - 86400
+        # mime type prefixes, '' matches everything
+        self._upload_allow = ('',) if 'all' in options['uploadAllow'] else tuple(options['uploadAllow'])
+        self._upload_deny = ('',) if 'all' in options['uploadDeny'] else tuple(options['uploadDeny'])
+        self._mime_cache: Dict[tuple, str] = {}
+
+        self._options = MappingProxyType(options)
+        # listings and validators depend on the whole configuration
+        self._options_key = repr(sorted((k, str(v)) for k, v in options.items()))
+
+        if self._options['tmbDir']:
+            dims_path = self._options['tmbDir'].joinpath('.dims.sqlite3')
+            try:
+                self._dims = DimensionCache(dims_path)
+                self._dims.open()
+            except (OSError, sqlite3.Error) as exc:
+                self._dims = None
+                self._debug("dims", f"Unable to open {dims_path}: {exc}")
+
+        if self._options['index']:
+            index_path = root_path.joinpath(self._options['index'])
+            try:
+                self._index = Index(index_path, root_path)
+                self._index.open()
+            except (OSError, sqlite3.Error) as exc:
+                self._index = None
+                self._debug("index", f"Unable to open {index_path}: {exc}")
+                print(f"WARNING: failed to open path index at {index_path}, "
+                      f"directories will be searched on disk.")
+
+        if self._options['dedup']:
+            if self._index is not None:
+                self._blobs = BlobStore(root_path.joinpath(self._options['dedupDir']))
+            else:
+                print("WARNING: 'dedup' option requires the index, files will not be deduplicated.")
 
-        self._response['debug'] = {}
+        if self._options['jobs']:
+            jobs_path = root_path.joinpath(self._options['jobsFile'])
+            try:
+                self._jobs = JobStore(jobs_path)
+                self._jobs.open()
+            except (OSError, sqlite3.Error) as exc:
+                self._jobs = None
+                self._debug("jobs", f"Unable to open {jobs_path}: {exc}")
+                print(f"WARNING: failed to open job queue at {jobs_path}, "
+                      f"commands will run within their requests.")
+
+    @property
+    def options(self) -> MappingProxyType:
+        """ Read-only configuration of the connector. """
+        return self._options
+
+    @property
+    def _state(self) -> RequestState:
+        state = _request_state.get()
+        if state is None or state.connector is not self:
+            state = self.__reset()
+        return state
+
+    def __reset(self) -> RequestState:
+        """ Flush per request variables """
+        state = RequestState(self)
+        _request_state.set(state)
+        return state
 
     def run(self, http_request: Dict[str, Any]) -> tuple[int, dict, str]:
         """ Run main function. """
@@ -194,12 +366,26 @@ class Connector:
                     c_attr = self._commands[cmd]
                     call_func = getattr(self, c_attr)
 
-                    try:
-                        call_func()
-                    except Exception as exc:  # pylint: disable=broad-except
-                        # self._response[RSP_ERROR] = f"Command Failed: {self._response[API_CMD]}, Error: \n{exc}"
-                        traceback.print_exc()
-                        self._debug('exception', exception_to_string(exc))
+                    job = current_job.get()
+                    if cmd in self._job_commands and self._jobs is not None and job is None:
+                        self._queue_job(cmd)
+                    else:
+                        if job is not None:
+                            job.start(self._job_total())
+
+                        if cmd in self._mutating_commands:
+                            # listing made by the command itself must not come from the cache
+                            self._bump_generation()
+
+                        try:
+                            call_func()
+                        except Exception as exc:  # pylint: disable=broad-except
+                            # self._response[RSP_ERROR] = f"Command Failed: {self._response[API_CMD]}, Error: \n{exc}"
+                            traceback.print_exc()
+                            self._debug('exception', exception_to_string(exc))
+
+                        if cmd in self._mutating_commands or (cmd == 'tmb' and self._response.get(RSP_IMAGES)):
+                            self._bump_generation()
 
                 else:
                     self._response[RSP_ERROR] = f"Unknown command"
@@ -243,11 +429,106 @@ class Connector:
 
         return self.http_status_code, self.http_header, self._response
 
+    def _queue_job(self, cmd: str) -> None:
+        """ Run command in the background, the client follows it with the status command """
+        try:
+            job_id = self._jobs.create(cmd, self._options['jobsTimeout'])
+        except sqlite3.Error as exc:
+            self._debug("jobs", str(exc))
+            self._response[RSP_ERROR] = "Unable to start job"
+            return
+
+        # the job gets a context of its own, with request state of its own
+        pool = get_job_pool(max(1, self._options['jobsWorkers']))
+        pool.submit(Context().run, self._run_job, job_id, dict(self._request))
+        self._response[RSP_JOB] = {'id': job_id, 'cmd': cmd, 'state': JOB_QUEUED}
+
+    def _run_job(self, job_id: str, http_request: Dict[str, Any]) -> None:
+        """ Run queued command in a worker thread and store its response for the status command """
+        progress = JobProgress(self._jobs, job_id)
+        current_job.set(progress)
+        try:
+            _, _, response = self.run(http_request)
+            root = str(self._options['root'])
+            errors = {os.path.relpath(path, root): error for path, error in self._error_data.items()}
+            self._jobs.finish(job_id, JOB_DONE, progress.done, errors, ''.join(iter_json(response)))
+        except Exception as exc:  # pylint: disable=broad-except
+            traceback.print_exc()
+            try:
+                self._jobs.finish(job_id, JOB_FAILED, progress.done, {'': str(exc)}, None)
+            except sqlite3.Error:
+                pass
+
+    def _job_total(self) -> int:
+        """ Return number of files the command of the running job works on """
+        base = self._request.get(API_SRC) or self._request.get(API_CURRENT)
+        cur_dir = self._find_dir(base, None) if base else None
+        targets = self._request.get(API_TARGETS) or self._request.get(API_TARGET) or []
+        if not isinstance(targets, list):
+            targets = [targets]
+
+        total = 0
+        if cur_dir:
+            for fhash in targets:
+                path = self._find(fhash, cur_dir)
+                if path:
+                    total += count_files(path)
+        return total
+
+    @staticmethod
+    def _advance(count: int = 1) -> None:
+        """ Count files processed by the running job """
+        job = current_job.get()
+        if job is not None:
+            job.add(count)
+
+    def listing_etag(self, http_request: Dict[str, Any]) -> Optional[str]:
+        """ Return validator of directory listing requested by open, None if it can not be computed cheaply. """
+        self.__reset()
+        if self._index is None or http_request.get(API_CMD, 'open') != 'open' or API_CURRENT in http_request:
+            return None
+        tree = API_TREE in http_request
+        if tree and not self._options['lazyTree']:
+            return None
+
+        root = Path(self._options['root'])
+        path = root
+        if http_request.get(API_TARGET):
+            path = self._find_dir(http_request[API_TARGET], None)
+            if not path:
+                return None
+        if not self._is_allowed(path, ACCESS_READ):
+            return None
+
+        # listing depends on the directory, on the tree branch leading to it and on the request
+        state = [
+            str(path), self._stat(path).st_mtime_ns, self._is_allowed(path, ACCESS_WRITE),
+            str(tree), str(API_INIT in http_request), str(self._today),
+        ]
+        state.extend(str(http_request.get(p)) for p in (API_SORT, API_ORDER, API_OFFSET, API_LIMIT))
+        if tree:
+            state.extend(self._stat(p).st_mtime_ns for p in path.parents if p == root or root in p.parents)
+
+        try:
+            state.append(self._index.generation())
+        except sqlite3.Error:
+            return None
+
+        state.append(self._options_key)
+        return f'"{make_hash(repr(state))}"'
+
+    def _bump_generation(self) -> None:
+        if self._index is not None:
+            try:
+                self._index.bump_generation()
+            except sqlite3.Error as exc:
+                self._debug("index", str(exc))
+
     def _cmd_open(self):
         """ Open file or directory. """
         if 'current' in self._request:
-            cur_dir = self._find_dir('current', None)
-            cur_file = self._find(self._request['target'], cur_dir)
+            cur_dir = self._find_dir(self._request['current'], None)
+            cur_file = self._find(self._request['target'], cur_dir) if cur_dir else None
 
             if not cur_dir or not cur_file or Path(cur_file).is_dir():
                 self.http_status_code = HTTP_NOT_FOUND
@@ -262,8 +543,8 @@ class Connector:
                 return
 
             if Path(cur_file).is_symlink():
-                # cur_file = read_link(cur_file)
-                cur_file = Path(read_link(cur_file))
+                # broken links and links leading out of root are not followed
+                cur_file = read_link(cur_file, self._options['root'])
 
                 if not cur_file or cur_file.is_dir():
                     self.http_status_code = HTTP_NOT_FOUND
@@ -280,23 +561,18 @@ class Connector:
                     return
 
             mime = self._mimetype(cur_file)
-            parts = mime.split('/', 2)
-
-            if parts[0] == 'image':
-                disp = 'image'
-            elif parts[0] == 'text':
-                disp = 'inline'
-            else:
-                disp = 'attachments'
+            # images and text are shown by the browser, everything else is downloaded
+            inline = mime.split('/', 1)[0] in ('image', 'text')
 
             self.http_status_code = HTTP_OK
             self.http_header['Content-type'] = mime
-            self.http_header['Content-Disposition'] = disp + '; filename=' + cur_file.name
-            self.http_header['Content-Location'] = str(cur_file).replace(self._options['root'], "")
+            self.http_header['Content-Disposition'] = content_disposition(not inline, cur_file.name)
+            self.http_header['Content-Location'] = self._path2url(cur_file)
             self.http_header['Content-Transfer-Encoding'] = 'binary'
             self.http_header['Content-Length'] = str(Path(cur_file).stat().st_size)
             self.http_header['Connection'] = 'close'
-            self.http_header['file'] = open(cur_file, 'r')
+            # file is sent by the view, which can stream it
+            self.http_header['file'] = Path(cur_file)
             return
 
         else:  # try dir
@@ -339,10 +615,11 @@ class Connector:
         elif Path(new_name).exists():
             self._response[RSP_ERROR] = "File or folder with the same name already exists"
         else:
-            self._rm_tmb(cur_name)
             try:
                 os.rename(cur_name, new_name)
-                self._response[RSP_SELECT] = [make_hash(str(new_name))]
+                self._index_move(cur_name, new_name)
+                self._dir_changed(cur_dir)
+                self._response[RSP_SELECT] = [self._hash(new_name)]
                 self._content(cur_dir, new_name.is_dir())
             except:
                 self._response['error'] = "Unable to rename file"
@@ -368,7 +645,8 @@ class Connector:
         else:
             try:
                 new_dir.mkdir(mode=0o755)
-                self._response[RSP_SELECT] = [make_hash(str(new_dir))]
+                self._index_add(new_dir)
+                self._response[RSP_SELECT] = [self._hash(new_dir)]
                 self._content(path, True)
             except:
                 self._response[RSP_ERROR] = "Unable to create folder"
@@ -394,7 +672,8 @@ class Connector:
         else:
             try:
                 open(new_file, 'w').close()
-                self._response[RSP_SELECT] = [make_hash(str(new_file))]
+                self._index_add(new_file)
+                self._response[RSP_SELECT] = [self._hash(new_file)]
                 self._content(cur_dir, False)
             except:
                 self._response[RSP_ERROR] = "Unable to create file"
@@ -421,6 +700,7 @@ class Connector:
                 continue
             self._remove(rm_file)
 
+        self._dir_changed(cur_dir)
         # TODO if errorData not empty return error
         self._content(cur_dir, True)
         return True
@@ -465,7 +745,6 @@ class Connector:
                         self._set_error_data(str(f), "Access denied")
                         self._content(cur_dir, True)
                         return
-                    # TODO thumbs
                     if new_dest.exists():
                         self._response[RSP_ERROR] = "Unable to move files"
                         self._set_error_data(str(f), "File or folder with the same name already exists")
@@ -473,7 +752,9 @@ class Connector:
                         return
                     try:
                         f.rename(new_dest)
-                        self._rm_tmb(f)
+                        self._index_move(f, new_dest)
+                        if current_job.get() is not None:
+                            self._advance(count_files(new_dest))
                         continue
                     except:
                         self._response[RSP_ERROR] = "Unable to move files"
@@ -485,8 +766,12 @@ class Connector:
                         self._response[RSP_ERROR] = "Unable to copy files"
                         self._content(cur_dir, True)
                         return
+                    self._index_add_tree(new_dest)
                     continue
 
+            self._dir_changed(dest)
+            if cut:
+                self._dir_changed(src)
             self._content(cur_dir, True)
         else:
             self._response[RSP_ERROR] = "Invalid parameters"
@@ -511,6 +796,8 @@ class Connector:
             if not self._copy(target, new_name):
                 self._response[RSP_ERROR] = "Unable to create file copy"
                 return
+            self._index_add_tree(new_name)
+            self._dir_changed(cur_dir)
 
         self._content(cur_dir, True)
         return
@@ -535,11 +822,14 @@ class Connector:
             if not self._is_allowed(cur_dir, ACCESS_WRITE):
                 self._response[RSP_ERROR] = "Access denied"
                 return
-            if not API_WIDTH in self._request:
+            if API_CHUNK in self._request:
+                self._upload_chunk(cur_dir)
+                return
+            if not API_UPLOAD in self._request:
                 self._response[RSP_ERROR] = "No file to upload"
                 return
 
-            upload_files = self._request[API_WIDTH]
+            upload_files = self._request[API_UPLOAD]
             # invalid format
             # must be dict('filename1': 'filedescriptor1', 'filename2': 'filedescriptor2', ...)
             if not isinstance(upload_files, dict):
@@ -548,47 +838,40 @@ class Connector:
 
             self._response[RSP_SELECT] = []
             total = 0
-            uploaded_size = 0
-            max_size = self._options['uploadMaxSize'] * 1024 * 1024
+            budget = UploadBudget(self._options['uploadMaxSize'] * 1024 * 1024)
+            accepted = []
 
-            self._response[RSP_SELECT] = []
             for name, data in upload_files.items():
                 if name:
                     total += 1
                     name = Path(name).name
 
-                    if not self._check_name(name):
+                    if getattr(data, 'rejected', None):
+                        # refused by the upload handler before its data was stored
+                        self._set_error_data(str(name), data.rejected)
+                    elif not self._check_name(name):
                         self._set_error_data(str(name), "Invalid name")
+                    elif not self._is_upload_allow(name):
+                        self._set_error_data(str(cur_dir.joinpath(name)), "Not allowed file type")
                     else:
-                        name = cur_dir.joinpath(name)
-                        try:
-                            # name.touch(0o644)
-                            f = open(name, 'wb', self._options['uploadWriteChunk'])
-                            for chunk in self._fbuffer(data):
-                                f.write(chunk)
-                            f.close()
-
-                            uploaded_size += name.lstat().st_size
-
-                            if self._is_upload_allow(str(name)):
-                                name.chmod(self._file_options['fileMode'])
-                                self._response[RSP_SELECT].append(make_hash(str(name)))
-                            else:
-                                self._set_error_data(str(name), "Not allowed file type")
-                                try:
-                                    name.unlink()
-                                except OSError:
-                                    pass
-                        except:  # OSError
-                            self._set_error_data(str(name), "Unable to save uploaded file")
-
-                        if uploaded_size > max_size:
-                            try:
-                                name.unlink()
-                                self._set_error_data(str(name), "File exceeds the maximum allowed filesize'")
-                            except OSError:
-                                pass
-                            break
+                        accepted.append((cur_dir.joinpath(name), data))
+
+            # files are stored and prepared in parallel, results are collected here in upload order
+            if len(accepted) > 1 and self._options['uploadWorkers'] > 1:
+                pool = get_upload_pool(self._options['uploadWorkers'])
+                results = [pool.submit(self._store_upload, data, path, budget) for path, data in accepted]
+                errors = [future.result() for future in results]
+            else:
+                errors = [self._store_upload(data, path, budget) for path, data in accepted]
+
+            stored = []
+            for (path, _), error in zip(accepted, errors):
+                if error:
+                    self._set_error_data(str(path), error)
+                else:
+                    self._response[RSP_SELECT].append(self._hash(path))
+                    stored.append(path)
+            self._index_add_many(stored)
 
             if self._error_data:
                if len(self._error_data) == total:
@@ -596,10 +879,257 @@ class Connector:
                else:
                    self._response[RSP_ERROR] = "Some files was not uploaded"
 
+            self._dir_changed(cur_dir)
             self._content(cur_dir, False)
             return
 
 
+    def _store_upload(self, data, dest: Path, budget: UploadBudget) -> Optional[str]:
+        """
+        Save uploaded file and prepare its thumbnail, return error message or None. May run in the upload pool,
+        so it does not touch the request state.
+        """
+        replaced = self._stored_digest(dest)
+        try:
+            size, digest = self._save_upload(data, dest)
+        except OSError:
+            return "Unable to save uploaded file"
+
+        if not budget.take(size):
+            try:
+                dest.unlink()
+            except OSError:
+                pass
+            return "File exceeds the maximum allowed filesize"
+
+        self._release(replaced)
+        if not (self._options['uploadImageProcess'] and self._mimetype(dest)[0:5] == 'image'):
+            # processed images are rewritten, they are not shared
+            self._share(dest, digest)
+        self._after_upload(dest)
+        return None
+
+    def _after_upload(self, path: Path) -> None:
+        """ Hand new image to the processing pipeline, or prepare its listing right away """
+        if not self._options['imgLib'] or self._mimetype(path)[0:5] != 'image':
+            return
+
+        if self._options['uploadImageProcess']:
+            try:
+                stat = path.stat()
+            except OSError:
+                return
+            queued = get_scheduler(self._options['tmbWorkers']).submit_image(
+                str(path),
+                max_size=self._options['uploadImageMaxSize'],
+                quality=self._options['uploadImageQuality'],
+                tmb_dir=str(self._options['tmbDir']) if self._options['tmbDir'] else None,
+                tmb_size=self._options['tmbSize'],
+                resample=self._options['resample'],
+                tmb_fmt=self._tmb_format(),
+                dims_db=str(self._dims.db_path) if self._dims is not None else None,
+                index_db=str(self._index.db_path) if self._index is not None else None,
+                root=self._options['root'],
+                expected=(stat.st_size, stat.st_mtime_ns),
+            )
+            if queued:
+                return
+
+        if self._options['tmbDir']:
+            if self._options['tmbBackground'] and self._queue_tmb(path):
+                return
+            self._prepare_image(path)
+
+    def _queue_tmb(self, path: Path) -> bool:
+        """ Queue thumbnail of new image in the worker processes, return False if the queue is full """
+        try:
+            tmb = self._tmb_path(path, path.stat())
+        except OSError:
+            return False
+        if not tmb:
+            return False
+        return get_scheduler(self._options['tmbWorkers']).submit(
+            str(path), str(tmb), self._options['tmbSize'], self._options['resample'], self._tmb_format()
+        )
+
+    def _prepare_image(self, path: Path) -> None:
+        """ Store dimensions and create thumbnail of a new image, so listing it does not decode it again """
+        try:
+            stat = path.stat()
+            dim = read_image_size(path)
+            if dim is not None and self._dims is not None:
+                self._dims.set(path, stat.st_size, stat.st_mtime_ns, dim)
+            tmb = self._tmb_path(path, stat)
+            if tmb:
+                ensure_thumbnail(
+                    str(path), str(tmb), self._options['tmbSize'], self._options['resample'], self._tmb_format()
+                )
+        except Exception:  # pylint: disable=broad-except
+            # not an image PIL can read, the listing reports it as it is
+            pass
+
+    def _save_upload(self, data, dest: Path) -> Tuple[int, Optional[str]]:
+        """ Move or copy uploaded file to dest, return its size and, with dedup, its digest if it is known """
+        digest = getattr(data, 'digest', None)
+        temporary_file_path = getattr(data, 'temporary_file_path', None)
+        if temporary_file_path is not None:
+            try:
+                # already on disk, on the same file system when written by ConnectorUploadHandler
+                os.chmod(temporary_file_path(), self._file_options['fileMode'])
+                os.replace(temporary_file_path(), dest)
+                return dest.lstat().st_size, digest
+            except OSError:
+                pass
+
+        hasher = hashlib.sha256() if self._blobs is not None else None
+        self._unshare(dest)
+        with open(dest, 'wb', self._options['uploadWriteChunk']) as f:
+            for chunk in self._fbuffer(data):
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+        dest.chmod(self._file_options['fileMode'])
+        return dest.lstat().st_size, hasher.hexdigest() if hasher is not None else None
+
+    def _stored_digest(self, path: Path) -> Optional[str]:
+        """ Return digest of file stored by dedup, None if it is not shared """
+        if self._blobs is None:
+            return None
+        try:
+            stat = path.stat()
+            if stat.st_nlink < 2:
+                return None
+            return self._index.get_digest(path, stat)
+        except (OSError, sqlite3.Error):
+            return None
+
+    def _share(self, path: Path, digest: Optional[str] = None) -> None:
+        """ Turn file into a link to the blob of its content (dedup option). Touches no request state. """
+        if self._blobs is None:
+            return
+        try:
+            digest = digest or file_digest(path)
+            self._blobs.link(path, digest)
+            self._index.set_digest(path, path.stat(), digest)
+        except (OSError, sqlite3.Error):
+            # other file system or no hardlinks, the file keeps its own copy
+            pass
+
+    def _release(self, digest: Optional[str]) -> None:
+        """ Drop blob no file links to anymore """
+        if digest is not None:
+            self._blobs.release(digest)
+
+    def _unshare(self, path: Path) -> None:
+        """ Give shared file its own copy before it is changed in place """
+        if self._blobs is None:
+            return
+        try:
+            if path.stat().st_nlink < 2:
+                return
+            # the link count decides, the digest is missing for files moved outside of the connector
+            digest = self._stored_digest(path) or file_digest(path)
+            self._blobs.unshare(path)
+        except OSError as exc:
+            self._debug('dedup', str(exc))
+            return
+        self._release(digest)
+
+    def upload_rejection(self, file_name: str) -> Optional[str]:
+        """ Return reason to refuse uploaded file by its name, None if it is accepted. """
+        chunk = parse_chunk(file_name)
+        name = Path(chunk[0] if chunk else file_name).name
+        if not self._check_name(name):
+            return "Invalid name"
+        if not self._is_upload_allow(name):
+            return "Not allowed file type"
+        return None
+
+    def upload_temp_dir(self) -> Optional[Path]:
+        """ Return folder on the file system of root for files being uploaded, None if it is disabled. """
+        if not self._options['uploadChunkDir']:
+            return None
+        path = Path(self._options['root']).joinpath(self._options['uploadChunkDir'])
+        path.mkdir(exist_ok=True)
+        return path
+
+    def _upload_chunk(self, cur_dir: Path) -> None:
+        """
+        Store one chunk of a file uploaded in parts ('chunk', 'cid' and 'range' parameters). Without file data
+        respond with the chunks received so far, so an interrupted upload can be resumed.
+        """
+        chunk = parse_chunk(self._request[API_CHUNK])
+        byte_range = parse_range(self._request.get(API_RANGE))
+        if chunk is None or byte_range is None or not self._options['uploadChunkDir']:
+            self._response[RSP_ERROR] = "Invalid parameters"
+            return
+
+        name, index, count = chunk
+        start, length, total = byte_range
+        name = Path(name).name
+        if not self._check_name(name):
+            self._response[RSP_ERROR] = "Invalid name"
+            return
+        if not self._is_upload_allow(name):
+            self._response[RSP_ERROR] = "Not allowed file type"
+            return
+        if total > self._options['uploadMaxSize'] * 1024 * 1024:
+            self._response[RSP_ERROR] = "File exceeds the maximum allowed filesize"
+            return
+
+        base = Path(self._options['root']).joinpath(self._options['uploadChunkDir'])
+        key = make_hash(f"{cur_dir}\0{name}\0{self._request.get(API_CID, '')}\0{count}\0{total}")
+        upload = ChunkedUpload(base, key, count, total)
+
+        files = self._request.get(API_UPLOAD)
+        if files:
+            if not isinstance(files, dict) or len(files) != 1:
+                self._response[RSP_ERROR] = "Invalid parameters"
+                return
+            data = next(iter(files.values()))
+            if getattr(data, 'rejected', None):
+                self._response[RSP_ERROR] = data.rejected
+                return
+            try:
+                if not upload.write(index, start, data, length):
+                    self._response[RSP_ERROR] = "Chunk size does not match its range"
+                    return
+            except OSError as exc:
+                self._debug('chunk', str(exc))
+                self._response[RSP_ERROR] = "Unable to save uploaded file"
+                return
+
+        received = upload.received()
+        self._response['chunks'] = received
+        if len(received) < count:
+            return
+
+        dest = cur_dir.joinpath(name)
+        replaced = self._stored_digest(dest)
+        try:
+            assembled = upload.assemble(dest, self._file_options['fileMode'])
+        except ValueError as exc:
+            self._debug('chunk', str(exc))
+            self._response[RSP_ERROR] = "Uploaded chunks do not match the file size"
+            return
+        except OSError as exc:
+            self._debug('chunk', str(exc))
+            self._response[RSP_ERROR] = "Unable to save uploaded file"
+            return
+        if not assembled:
+            # merged by a parallel request
+            return
+
+        purge_stale(base, self._options['uploadChunkTimeout'])
+        self._release(replaced)
+        if not (self._options['uploadImageProcess'] and self._mimetype(dest)[0:5] == 'image'):
+            self._share(dest)
+        self._after_upload(dest)
+        self._response[RSP_SELECT] = [self._hash(dest)]
+        self._index_add(dest)
+        self._dir_changed(cur_dir)
+        self._content(cur_dir, False)
+
     def _cmd_resize(self) -> None:
         """ Scale image size. """
         cur_dir = self._find_dir(self._request[API_CURRENT], None)
@@ -632,23 +1162,23 @@ class Connector:
             return
 
         try:
-            img = self._im.open(cur_file)
-            img_resized = img.resize((width, height), self._im.ANTIALIAS)  # type: ignore
-            img_resized.save(cur_file)
+            self._unshare(cur_file)
             self._rm_tmb(cur_file)
+            resize_image(str(cur_file), width, height, self._options['resample'])
+            self._dir_changed(cur_file.parent)
         except OSError as exc:
             self._debug(f"resizeFailed_{cur_file}", str(exc))
             self._response[RSP_ERROR] = "Unable to resize image"
             return
 
-        self._response[RSP_SELECT] = [make_hash(str(cur_file)), ]
+        self._response[RSP_SELECT] = [self._hash(cur_file), ]
         self._content(cur_dir, True)
 
     def _cmd_thumbnails(self) -> bool:
         """ Create previews for images. """
         if API_CURRENT in self._request:
             cur_dir = self._find_dir(self._request[API_CURRENT], None)
-            if not cur_dir or cur_dir == self._options['tmbDir']:
+            if not cur_dir or self._in_tmb_dir(cur_dir):
                 return False
         else:
             return False
@@ -660,18 +1190,22 @@ class Connector:
             if self._options['tmbAtOnce'] > 0:
                 tmb_max = self._options['tmbAtOnce']
 
-            self._response[API_CURRENT] = make_hash(str(cur_dir))
+            self._response[API_CURRENT] = self._hash(cur_dir)
             self._response[RSP_IMAGES] = {}
             i = 0
 
+            if self._options['tmbBackground']:
+                self._schedule_tmb(cur_dir)
+                return True
+
             for f in cur_dir.iterdir():
-                fhash = make_hash(str(f))
+                fhash = self._hash(f)
 
                 _can_create_thumb_f = self._can_create_tmb(f)
                 _allow_read_f = self._is_allowed(f, ACCESS_READ)
 
                 if self._can_create_tmb(f) and self._is_allowed(f, ACCESS_READ):
-                    tmb_path = Path(self._options['tmbDir']).joinpath(f"{fhash}.png")
+                    tmb_path = self._tmb_path(f)
 
                     if not tmb_path.exists():
 
@@ -690,18 +1224,122 @@ class Connector:
 
         return True
 
+    def _schedule_tmb(self, cur_dir: Path) -> None:
+        """ Queue missing thumbnails of directory and report those which are ready. """
+        scheduler = get_scheduler(self._options['tmbWorkers'])
+
+        with os.scandir(cur_dir) as it:
+            for entry in it:
+                f = Path(entry.path)
+                if not entry.is_file() or not self._can_create_tmb(f) or not self._is_allowed(f, ACCESS_READ):
+                    continue
+
+                tmb_path = self._tmb_path(f)
+                if tmb_path.exists():
+                    self._response[RSP_IMAGES][self._hash(f)] = self._path2url(tmb_path)
+                elif not scheduler.failed(str(tmb_path)):
+                    scheduler.submit(
+                        str(f), str(tmb_path), self._options['tmbSize'], self._options['resample'], self._tmb_format()
+                    )
+                    self._response['tmb'] = True
+
+    def _cmd_tree(self) -> None:
+        """ Return subdirectories of one directory, used to expand lazy tree. """
+        target = None
+        if API_TARGET in self._request:
+            target = self._find_dir(self._request[API_TARGET], None)
+
+        if not target:
+            self._response[RSP_ERROR] = "Invalid parameters"
+        elif not self._is_allowed(target, ACCESS_READ):
+            self._response[RSP_ERROR] = "Access denied"
+        else:
+            self._response[API_TREE] = self._indexed_tree(target, self._get_lazy_tree(target))
+
+    def thumbnail(self, fhash: str) -> Optional[Path]:
+        """ Return path of thumbnail for image by hash, creating it on first request. """
+        self.__reset()
+        path = self._find_file(str(fhash))
+        if path is None or not self._is_allowed(path, ACCESS_READ) or not self._can_create_tmb(path):
+            return None
+
+        self._init_img_lib()
+        tmb = self._tmb_path(path)
+        if not self._im or not tmb:
+            return None
+
+        try:
+            ensure_thumbnail(str(path), str(tmb), self._options['tmbSize'], self._options['resample'], self._tmb_format())
+        except Exception as exc:  # pylint: disable=broad-except
+            self._debug(f"tmbFailed_{path}", str(exc))
+            return None
+
+        return tmb
+
+    def thumbnail_mimetype(self) -> str:
+        return f"image/{self._tmb_format().lower()}"
+
     def _cmd_ping(self) -> None:
         """ Workaround for Safari. """
         self.http_status_code = 200
         self.http_header["Connection"] = "close"
 
+    def _cmd_status(self) -> None:
+        """ Report progress of background job; once it is done, the response of its command. """
+        job = None
+        if self._jobs is not None and self._request.get(API_JOB):
+            try:
+                job = self._jobs.get(str(self._request[API_JOB]))
+            except sqlite3.Error as exc:
+                self._debug("jobs", str(exc))
+
+        if job is None:
+            self._response[RSP_ERROR] = "Invalid parameters"
+            return
+
+        del job['pid']
+        result = job.pop('result')
+        if job['state'] == JOB_DONE and result:
+            self._response.update(result)
+        self._response[RSP_JOB] = job
+
     def _content(self, path: Path, tree):
         """ CWD + CDC + maybe(TREE) """
+        # listing goes after any modification made by the command
+        self._stats.clear()
+        self._access.clear()
         self._cwd(path)
         self._cdc(path)
 
         if tree:
-            self._response[API_TREE] = self._get_dirs_tree(Path(self._options['root']))
+            root = Path(self._options['root'])
+            if self._options['lazyTree']:
+                branch = [path] + [p for p in path.parents if p == root or root in p.parents]
+                self._response[API_TREE] = self._cached(
+                    ('lazytree', str(path), [self._stat(p).st_mtime_ns for p in branch]),
+                    lambda: self._indexed_tree(root, self._get_lazy_tree(root, path))
+                )
+            else:
+                self._response[API_TREE] = self._cached(
+                    ('tree', self._stat(root).st_mtime_ns),
+                    lambda: self._indexed_tree(root, self._get_dirs_tree(root))
+                )
+
+    def _cached(self, key: tuple, build):
+        """ Return listing from listing cache or build and store it. """
+        if self._listing_cache is None or self._index is None:
+            return build()
+        try:
+            generation = self._index.generation()
+        except sqlite3.Error:
+            return build()
+
+        key = self._listing_cache.make_key(key, generation, self._today, self._options_key)
+        value = self._listing_cache.get(key)
+        if value is None:
+            value = build()
+            self._listing_cache.set(key, value)
+        return value
 
     def _cwd(self, path: Path) -> None:
         """ Get Current Working Directory. """
@@ -720,12 +1358,12 @@ class Connector:
         rel = basename + str(path)[len(self._options['root']):]
 
         self._response['cwd'] = {
-            'hash': make_hash(str(path)),
+            'hash': self._hash(path),
             'name': self._check_utf8(name),
             'mime': 'directory',
             'rel': self._check_utf8(rel),
             'size': 0,
-            'date': datetime.fromtimestamp(Path(path).stat().st_mtime).strftime('%d %b %Y %H:%M'),
+            'date': datetime.fromtimestamp(self._stat(path).st_mtime).strftime('%d %b %Y %H:%M'),
             'read': True,
             'write': self._is_allowed(path, ACCESS_WRITE),
             'rm': not root and self._is_allowed(path, ACCESS_RM),
@@ -733,39 +1371,156 @@ class Connector:
 
     def _cdc(self, path: Path):
         """ Current Directory Content" """
-        files = []
-        dirs = []
+        sort = self._request.get(API_SORT)
+        if sort not in self._sort_keys:
+            sort = None
+        reverse = self._request.get(API_ORDER) == 'desc'
+        offset = self._int_param(API_OFFSET) or 0
+        limit = self._int_param(API_LIMIT) or None
+
+        if self._options['streamListing']:
+            # entries are produced while the response is written, nothing is cached
+            if sort is None and not offset and limit is None:
+                self._response['cdc'] = self._in_context(self._iter_dir(path))
+            else:
+                page, total = self._select_entries(path, sort, reverse, offset, limit)
+                self._response['cdc'] = self._in_context(self._iter_dir(path, page))
+                self._response['total'] = total
+            return
 
-        for item in sorted(path.iterdir()):
-            if not self._is_accepted(str(item)):
-                continue
+        cdc, tmb, total = self._cached(
+            ('cdc', str(path), self._stat(path).st_mtime_ns, sort, reverse, offset, limit),
+            lambda: self._read_dir(path, sort, reverse, offset, limit)
+        )
+        self._response['cdc'] = cdc
+        if tmb:
+            self._response['tmb'] = True
+        if limit is not None or offset:
+            self._response['total'] = total
+
+    def _read_dir(
+            self, path: Path, sort: Optional[str] = None, reverse: bool = False,
+            offset: int = 0, limit: Optional[int] = None
+    ) -> Tuple[list, bool, int]:
+        """ Return page of directory content, flag of missing thumbnails and number of entries """
+        page, total = self._select_entries(path, sort, reverse, offset, limit)
+
+        cdc = []
+        listed = []
+        for entry in page:
+            path_joined = path.joinpath(entry.name)
+            cdc.append(self._info(path_joined, entry))
+            listed.append(path_joined)
+
+        self._index_add_many(listed)
+        return cdc, bool(self._response.get('tmb')), total
+
+    def _select_entries(
+            self, path: Path, sort: Optional[str] = None, reverse: bool = False,
+            offset: int = 0, limit: Optional[int] = None
+    ) -> Tuple[List[os.DirEntry], int]:
+        """ Return sorted page of accepted directory entries and number of entries """
+        with os.scandir(path) as it:
+            entries = [e for e in it if self._is_accepted(e.name)]
+
+        # directories go first, only the requested page is stat-ed unless sorting needs it
+        dirs = [e for e in entries if e.is_dir()]
+        files = [e for e in entries if not e.is_dir()]
+        if sort is None:
+            sort_key = lambda e: e.name
+        elif sort == 'name':
+            sort_key = lambda e: natural_key(e.name)
+        elif sort == 'kind':
+            sort_key = lambda e: (self._mimetype(Path(e.name)), natural_key(e.name))
+        elif sort == 'date':
+            sort_key = lambda e: (self._entry_stat(path, e).st_mtime, natural_key(e.name))
+        else:
+            sort_key = lambda e: (
+                self._get_dir_size(path.joinpath(e.name)) if e.is_dir() else self._entry_stat(path, e).st_size,
+                natural_key(e.name)
+            )
+        dirs.sort(key=sort_key, reverse=reverse)
+        files.sort(key=sort_key, reverse=reverse)
 
-            path_joined = path.joinpath(item)
-            # info = {}
-            info = self._info(path_joined)
-            info['hash'] = make_hash(str(path_joined))
+        entries = dirs + files
+        page = entries[offset:offset + limit] if limit is not None else entries[offset:]
+        return page, len(entries)
 
-            if info['mime'] == 'directory':
-                dirs.append(info)
-            else:
-                files.append(info)
+    @staticmethod
+    def _in_context(iterator: Iterator) -> Iterator:
+        """ Advance iterator in the context of the current request, wherever the response is consumed """
+        context = copy_context()
+        try:
+            while True:
+                try:
+                    item = context.run(next, iterator)
+                except StopIteration:
+                    return
+                yield item
+        finally:
+            context.run(iterator.close)
+
+    def _iter_dir(self, path: Path, entries: Optional[List[os.DirEntry]] = None) -> Iterator[Entry]:
+        """ Yield records of directory content, in directory order unless entries are given """
+        listed = []
+        it = None
+        if entries is None:
+            it = entries = os.scandir(path)
+        try:
+            for entry in entries:
+                if not self._is_accepted(entry.name):
+                    continue
+                path_joined = path.joinpath(entry.name)
+                try:
+                    record = self._record(path_joined, entry)
+                except OSError:
+                    # removed while listing
+                    continue
+                finally:
+                    # keep memory flat, every entry is looked at once
+                    self._forget(path_joined)
+                listed.append(path_joined)
+                if len(listed) >= 1000:
+                    self._index_add_many(listed)
+                    listed = []
+                yield record
+        finally:
+            if it is not None:
+                it.close()
+            self._index_add_many(listed)
+
+    def _entry_stat(self, path: Path, entry: os.DirEntry) -> os.stat_result:
+        return self._stat(path.joinpath(entry.name), entry) or entry.stat(follow_symlinks=False)
+
+    def _int_param(self, name: str) -> Optional[int]:
+        """ Return non-negative integer request parameter or None """
+        try:
+            value = int(self._request.get(name))
+        except (TypeError, ValueError):
+            return None
+        return value if value >= 0 else None
 
-        dirs.extend(files)
-        self._response['cdc'] = dirs
+    def _info(self, path: Path, entry: Optional[os.DirEntry] = None) -> Dict:
+        return self._record(path, entry).as_dict()
 
-    def _info(self, path: Path) -> Dict:
+    def _record(self, path: Path, entry: Optional[os.DirEntry] = None) -> Entry:
+        """ Return file info record. """
         mime = ''
         filetype = "file"
 
-        # pure_path = Path(path)
-        if path.is_fifo():
-            filetype = 'file'
-        if path.is_dir():
-            filetype = 'dir'
-        if path.is_symlink():
-            filetype = 'link'
+        # DirEntry answers type questions from the directory listing itself
+        if entry is not None:
+            if entry.is_symlink():
+                filetype = 'link'
+            elif entry.is_dir():
+                filetype = 'dir'
+        else:
+            if path.is_dir():
+                filetype = 'dir'
+            if path.is_symlink():
+                filetype = 'link'
 
-        stat = path.stat()
+        stat = self._stat(path, entry) or path.lstat()
         stat_date = datetime.fromtimestamp(stat.st_mtime)
 
         find_date = ''
@@ -776,67 +1531,70 @@ class Connector:
         else:
             find_date = stat_date.strftime('%d %b %Y %H:%M')
 
-        info = {
-            'name': path.name,
-            'hash': make_hash(str(path)),
-            'mime': 'directory' if filetype == 'dir' else self._mimetype(path),
-            'date': find_date,
-            'size': self._get_dir_size(path) if filetype == 'dir' else stat.st_size,
-            'read': self._is_allowed(path, ACCESS_READ),
-            'write': self._is_allowed(path, ACCESS_WRITE),
-            'rm': self._is_allowed(path, ACCESS_RM),
-        }
+        info = Entry(
+            name=path.name,
+            hash=self._hash(path),
+            mime='directory' if filetype == 'dir' else self._mimetype(path),
+            date=find_date,
+            size=self._get_dir_size(path) if filetype == 'dir' else stat.st_size,
+            read=self._is_allowed(path, ACCESS_READ),
+            write=self._is_allowed(path, ACCESS_WRITE),
+            rm=self._is_allowed(path, ACCESS_RM),
+        )
 
         if filetype == 'link':
-            link_path = read_link(path)
+            link_path = read_link(path, self._options['root'])
 
             if not link_path:
-                info['mime'] = 'symlink-broken'
+                info.mime = 'symlink-broken'
                 return info
 
             if Path(link_path).is_dir():
-                info['mime'] = 'directory'
+                info.mime = 'directory'
             else:
-                info['parent'] = make_hash(str(Path(link_path).parent))
-                info['mime'] = self._mimetype(path)
+                info.parent = self._hash(Path(link_path).parent)
+                info.mime = self._mimetype(path)
 
             if self._options['rootAlias']:
                 basename = self._options['rootAlias']
             else:
                 basename = Path(self._options['root']).name
 
-            info['link'] = make_hash(str(link_path))
-            info['linkTo'] = basename + link_path[len(self._options['root']):]
-            info['read'] = info['read'] and self._is_allowed(link_path, ACCESS_READ)
-            info['write'] = info['write'] and self._is_allowed(link_path, ACCESS_WRITE)
-            info['rm'] = self._is_allowed(link_path, ACCESS_RM)
+            info.link = self._hash(link_path)
+            info.linkTo = basename + str(link_path)[len(self._options['root']):]
+            info.read = info.read and self._is_allowed(link_path, ACCESS_READ)
+            info.write = info.write and self._is_allowed(link_path, ACCESS_WRITE)
+            info.rm = self._is_allowed(link_path, ACCESS_RM)
         else:
             link_path = False
 
-        if not info['mime'] == 'directory':
-            if self._options['fileURL'] and info['read'] is True:
+        if not info.mime == 'directory':
+            if self._options['fileURL'] and info.read is True:
                 if link_path:
-                    info['url'] = self._path2url(link_path)
+                    info.url = self._path2url(link_path)
                 else:
-                    info['url'] = self._path2url(path)
+                    info.url = self._path2url(path)
 
-            if info['mime'][0:5] == 'image':
+            if info.mime[0:5] == 'image':
                 if self._can_create_tmb():
                     dim = self._get_img_size(path)
                     if dim:
-                        info['dim'] = dim
-                        info['resize'] = True
+                        info.dim = dim
+                        info.resize = True
 
                     # if we are in tmb dir, files are thumbs itself
-                    if path.parent == self._options['tmbDir']:
-                        info['tmb'] = self._path2url(path)
+                    if self._in_tmb_dir(path):
+                        info.tmb = self._path2url(path)
                         return info
 
-                    tmb = Path(self._options['tmbDir']).joinpath(f"{info['hash']}.png'")
+                    tmb = self._tmb_path(path)
 
-                    if Path(tmb).exists():
+                    if self._options['tmbOnDemand'] and self._options['tmbURL']:
+                        # served by the thumbnail view, the key changes together with the image
+                        info.tmb = f"{self._options['tmbURL']}{quote(info.hash)}/?v={Path(tmb).name}"
+                    elif Path(tmb).exists():
                         tmb_url = self._path2url(tmb)
-                        info['tmb'] = tmb_url
+                        info.tmb = tmb_url
                     else:
                         self._response['tmb'] = True
 
@@ -849,26 +1607,74 @@ class Connector:
         if dir_path.is_symlink():
             return ""
 
+        tree = self._tree_node(dir_path)
+
+        if tree['read']:
+            for pd in self._subdirs(dir_path):
+                tree['dirs'].append(self._get_dirs_tree(pd))
+
+        return tree
+
+    def _get_lazy_tree(self, dir_path: Path, target: Optional[Path] = None) -> Dict:
+        """ Return directory with its subdirectories, expanded further only on the way to target. """
+        tree = self._tree_node(dir_path)
+
+        if tree['read']:
+            for pd in self._subdirs(dir_path):
+                if target is not None and (pd == target or pd in target.parents):
+                    tree['dirs'].append(self._get_lazy_tree(pd, target))
+                else:
+                    node = self._tree_node(pd)
+                    node['hasdirs'] = node['read'] and self._has_subdirs(pd)
+                    tree['dirs'].append(node)
+
+        tree['hasdirs'] = bool(tree['dirs'])
+        return tree
+
+    def _indexed_tree(self, dir_path: Path, tree):
+        """ Register directories of tree built for dir_path, their hashes are used by the next commands. """
+        listed = []
+        stack = [(dir_path, tree)] if tree else []
+        while stack:
+            path, node = stack.pop()
+            for child in node['dirs']:
+                child_path = path.joinpath(child['name'])
+                listed.append(child_path)
+                stack.append((child_path, child))
+        self._index_add_many(listed)
+        return tree
+
+    def _tree_node(self, dir_path: Path) -> Dict:
+        """ Return tree entry of directory without subdirectories. """
         if str(dir_path) == self._options['root'] and self._options['rootAlias']:
             name = self._options['rootAlias']
         else:
             name = dir_path.name
 
-        tree = {
-            'hash': make_hash(str(dir_path)),
+        return {
+            'hash': self._hash(dir_path),
             'name': self._check_utf8(name),
             'read': self._is_allowed(dir_path, ACCESS_READ),
             'write': self._is_allowed(dir_path, ACCESS_WRITE),
             'dirs': []
         }
 
-        if self._is_allowed(dir_path, ACCESS_READ):
-            for d in sorted(os.listdir(dir_path)):
-                pd = dir_path.joinpath(d)
-                if os.path.isdir(pd) and not os.path.islink(pd) and self._is_accepted(d):
-                    tree['dirs'].append(self._get_dirs_tree(pd))
+    def _subdirs(self, dir_path: Path) -> list:
+        """ Return sorted list of visible, not symlinked subdirectories. """
+        with os.scandir(dir_path) as it:
+            names = [e.name for e in it if e.is_dir(follow_symlinks=False) and self._is_accepted(e.name)]
+        return [dir_path.joinpath(name) for name in sorted(names)]
 
-        return tree
+    def _has_subdirs(self, dir_path: Path) -> bool:
+        """ Check if directory has at least one visible subdirectory. """
+        try:
+            with os.scandir(dir_path) as it:
+                for e in it:
+                    if e.is_dir(follow_symlinks=False) and self._is_accepted(e.name):
+                        return True
+        except OSError:
+            pass
+        return False
 
     def _remove(self, target: Path) -> bool:
         """ Provide internal remove procedure. """
@@ -877,8 +1683,14 @@ class Connector:
 
         if not target.is_dir():
             try:
-                self._rm_tmb(target)
+                digest = self._stored_digest(target)
+                # other links of a deduplicated file keep using the thumbnail
+                if digest is None or target.stat().st_nlink <= 2:
+                    self._rm_tmb(target)
                 target.unlink()
+                self._release(digest)
+                self._index_remove(target)
+                self._advance()
                 return True
             except:
                 self._set_error_data(str(target), "Remove failed")
@@ -890,6 +1702,7 @@ class Connector:
 
             try:
                 target.rmdir()
+                self._index_remove(target)
                 return True
             except:
                 self._set_error_data(str(target), "Access denied")
@@ -914,27 +1727,96 @@ class Connector:
 
         if not src.is_dir():
             try:
-                shutil.copyfile(src, dest)
-                shutil.copymode(src, dest)
+                self._copy_file(src, dest)
+                self._advance()
                 return True
-            except:
+            except OSError:
                 self._set_error_data(str(src), "Unable to copy files")
                 return False
-        else:
+
+        pool = get_copy_pool(max(1, self._options['copyWorkers']))
+        job = current_job.get()
+        errors = copy_tree(src, dest, self._copy_file, pool, job.add if job is not None else None)
+        for path, error in errors:
+            self._debug(f"copy_{path}", error)
+            self._set_error_data(path, "Unable to copy files")
+        return not errors
+
+    def _copy_file(self, src, dest) -> None:
+        """ Copy one file, carrying its thumbnail over. Runs on the copy pool, touches no request state. """
+        src, dest = Path(src), Path(dest)
+        if self._blobs is not None:
+            # links share the inode and with it the thumbnail
+            self._link_copy(src, dest)
+            return
+
+        stat = src.stat()
+        copy_file(src, dest)
+        self._copy_tmb(stat, dest)
+
+    def _copy_tmb(self, stat: os.stat_result, dest: Path) -> None:
+        """ Copy existing thumbnail of a file to the key of its copy instead of rendering it again """
+        tmb_dir = self._options['tmbDir']
+        if not tmb_dir or self._in_tmb_dir(dest):
+            return
+        size, fmt = self._options['tmbSize'], self._tmb_format()
+        tmb = thumbnail_path(tmb_dir, stat, size, fmt)
+        if not os.path.exists(tmb):
+            return
+        try:
+            new_tmb = Path(thumbnail_path(tmb_dir, dest.stat(), size, fmt))
+            new_tmb.parent.mkdir(parents=True, exist_ok=True)
+            copy_file(Path(tmb), new_tmb)
+        except OSError:
+            # rendered on demand like any missing thumbnail
+            pass
+
+    def _link_copy(self, src, dest) -> None:
+        """ Copy file as another link to the blob of its content (dedup option) """
+        src, dest = Path(src), Path(dest)
+        stat = src.stat()
+        digest = None
+        try:
+            digest = self._index.get_digest(src, stat)
+        except sqlite3.Error:
+            pass
+        if digest is None:
+            self._share(src)
+            stat = src.stat()
             try:
-                # dest.mkdir()
-                shutil.copytree(src, dest)
-                shutil.copymode(src, dest)
-            except:
-                self._set_error_data(str(src), "Unable to copy files")
-                return False
+                digest = self._index.get_digest(src, stat)
+            except sqlite3.Error:
+                pass
 
-        return True
+        blob = self._blobs.path(digest) if digest else None
+        if blob is not None and blob.exists() and blob.stat().st_ino == stat.st_ino:
+            os.link(blob, dest)
+            try:
+                self._index.set_digest(dest, stat, digest)
+            except sqlite3.Error:
+                pass
+        else:
+            copy_file(src, dest)
+            self._copy_tmb(stat, dest)
 
     def _find_dir(self, fhash: str, path: Optional[Path] = None) -> Optional[Path]:
         """ Find directory by hash. """
         find_hash = str(fhash)
+        if not path and self._path_ids:
+            found = self._decode_hash(find_hash)
+            if found is not None and found.is_dir() and not found.is_symlink():
+                return found
+            return None
+
+        if not path and self._index is not None:
+            found = self._index_find(find_hash)
+            if found is not None and found.is_dir() and not found.is_symlink():
+                return found
+            return None
+
         if not path:
+            if not is_hash(find_hash):
+                return None
             path = Path(self._options['root'])
             if find_hash == make_hash(str(path)):
                 return path
@@ -958,14 +1840,135 @@ class Connector:
         """ Find file/dir by hash. """
         find_hash = str(fhash)
 
+        if self._path_ids:
+            found = self._decode_hash(find_hash)
+            if found is not None and found.parent == parent_dir and (found.exists() or found.is_symlink()):
+                return found
+            return None
+
+        if not is_hash(find_hash):
+            return None
+
+        if self._index is not None:
+            found = self._index_get(find_hash)
+            if found is not None and found.parent == parent_dir and (found.exists() or found.is_symlink()):
+                return found
+
         if parent_dir.is_dir():
+            listed = []
             for d in parent_dir.iterdir():
                 path_joined = parent_dir.joinpath(d)
+                listed.append(path_joined)
                 if find_hash == make_hash(str(path_joined)):
+                    self._index_add_many(listed)
                     return path_joined
+            self._index_add_many(listed)
+
+        return None
 
+    def _find_file(self, fhash: str) -> Optional[Path]:
+        """ Find file/dir by hash anywhere under root, without scanning. """
+        if self._path_ids:
+            found = self._decode_hash(fhash)
+            if found is not None and (found.exists() or found.is_symlink()):
+                return found
+        elif self._index is not None:
+            return self._index_get(fhash)
+        return None
+
+    def _hash(self, path: Path) -> str:
+        """ Return identifier of path used in responses. """
+        if self._path_ids:
+            rel = os.path.relpath(str(path), self._options['root'])
+            return encode_path_id('' if rel == '.' else rel, self._options['hashSecret'])
+        return make_hash(str(path))
+
+    def _decode_hash(self, fhash: str) -> Optional[Path]:
+        """ Return path for identifier made by _hash in 'path' mode or None if it is invalid. """
+        rel = decode_path_id(fhash, self._options['hashSecret'])
+        if rel is None:
+            return None
+        root = Path(self._options['root'])
+        return root.joinpath(rel) if rel else root
+
+    def _index_get(self, fhash: str) -> Optional[Path]:
+        """ Look hash up in the path index, dropping stale entries. """
+        try:
+            found = self._index.get(fhash)
+            if found is None:
+                return None
+            if make_hash(str(found)) == fhash and (found.exists() or found.is_symlink()):
+                return found
+            self._index.remove(found)
+        except sqlite3.Error as exc:
+            self._debug("index", str(exc))
         return None
 
+    def _index_find(self, fhash: str) -> Optional[Path]:
+        """
+        Resolve hash through the path index. An unknown hash rebuilds the index if it was not rebuilt within
+        indexRebuildInterval seconds, so unknown hashes can not make every request walk the whole tree.
+        """
+        if not is_hash(fhash):
+            return None
+        found = self._index_get(fhash)
+        if found is None and not self._index_rebuilt:
+            self._index_rebuilt = True
+            try:
+                if self._index.claim_rebuild(self._options['indexRebuildInterval']):
+                    self._debug("index_rebuild", self._index.rebuild(self._options['dotFiles']))
+                    found = self._index_get(fhash)
+            except sqlite3.Error as exc:
+                self._debug("index", str(exc))
+        return found
+
+    def _index_add(self, path: Path) -> None:
+        """ Register new path in the path index. """
+        self._index_add_many([path])
+
+    def _index_add_many(self, paths) -> None:
+        if self._index is not None and not self._path_ids:
+            try:
+                self._index.add_many(paths)
+            except sqlite3.Error as exc:
+                self._debug("index", str(exc))
+
+    def _dir_changed(self, path: Path) -> None:
+        """ Drop stored recursive sizes of directory and its ancestors after modifying it. """
+        if self._index is not None and self._options['dirSize']:
+            try:
+                self._index.invalidate_sizes(path)
+            except sqlite3.Error as exc:
+                self._debug("index", str(exc))
+
+    def _index_move(self, src: Path, dest: Path) -> None:
+        """ Register renamed or moved path, keeping the digests dedup stored for it. """
+        if self._index is not None:
+            try:
+                self._index.move(src, dest)
+            except sqlite3.Error as exc:
+                self._debug("index", str(exc))
+        self._index_remove(src)
+        self._index_add_tree(dest)
+
+    def _index_add_tree(self, path: Path) -> None:
+        """ Register new path and, for a directory, every directory below it. """
+        if path.is_symlink() or not path.is_dir():
+            self._index_add(path)
+        elif self._index is not None and not self._path_ids:
+            try:
+                self._index.add_tree(path, self._options['dotFiles'])
+            except sqlite3.Error as exc:
+                self._debug("index", str(exc))
+
+    def _index_remove(self, path: Path) -> None:
+        """ Drop path and its descendants from the path index. """
+        if self._index is not None:
+            try:
+                self._index.remove(path)
+            except sqlite3.Error as exc:
+                self._debug("index", str(exc))
+
     def _cmd_read(self):
         if API_CURRENT in self._request and API_TARGET in self._request:
             cur_dir = self._find_dir(self._request[API_CURRENT], None)
@@ -990,9 +1993,13 @@ class Connector:
             if cur_dir and cur_file:
                 if self._is_allowed(cur_file, ACCESS_WRITE):
                     try:
+                        self._unshare(cur_file)
                         with open(cur_file, "w") as f:
                             f.write(self._request[API_CONTENT])
+                        self._dir_changed(cur_dir)
 
+                        # stat memoized by the access check is from before the write
+                        self._forget(cur_file)
                         self._response[API_TARGET] = self._info(cur_file)
                     except :
                         self._response[RSP_ERROR] = "Unable to write to file"
@@ -1006,6 +2013,20 @@ class Connector:
 
     def _mimetype(self, path: Path) -> str:
         """ Detect mimetype of file. """
+        # the result only depends on the last two extensions and on the README rule below
+        key = (tuple(path.suffixes[-2:]), path.stem in ('README', 'ChangeLog'))
+        try:
+            return self._mime_cache[key]
+        except KeyError:
+            pass
+
+        mime = self._guess_mimetype(path)
+        if len(self._mime_cache) >= 4096:
+            self._mime_cache.clear()
+        self._mime_cache[key] = mime
+        return mime
+
+    def _guess_mimetype(self, path: Path) -> str:
         mime = mimetypes.guess_type(path)[0] or "unknown"
         ext = path.suffix
 
@@ -1029,16 +2050,7 @@ class Connector:
     def _make_tmb(self, path: str, tmb_path: str) -> bool:
         """ Provide internal thumbnail create procedure. """
         try:
-            im = self._im.open(path).copy()
-            size = self._options['tmbSize'], self._options['tmbSize']
-            box = crop_tuple(im.size)
-
-            if box:
-                im.crop(box)
-
-            im.thumbnail(size, self._im.ANTIALIAS)
-            im.save(tmb_path, 'PNG')
-
+            make_thumbnail(path, tmb_path, self._options['tmbSize'], self._options['resample'], self._tmb_format())
         except Exception as e:
             self._debug(f"tmbFailed_{path}", str(e))
             return False
@@ -1047,7 +2059,7 @@ class Connector:
 
     def _rm_tmb(self, path: Path) -> None:
         """ Remove thumbnail for get image file """
-        tmb = Path(self._tmb_path(path))
+        tmb = self._tmb_path(path)
         if tmb:
             if tmb.exists():
                 try:
@@ -1059,17 +2071,56 @@ class Connector:
         """ Get size of directory entry """
         total_size = 0
 
-        if self._options['dirSize']:
-            for dir_path, dir_names, file_names in os.walk(path):
-                for f in file_names:
-                    fp = Path(dir_path).joinpath(f)
-                    if fp.exists():
-                        total_size += fp.stat().st_size
+        if self._options['dirSize'] and self._index is not None:
+            computed = []
+            try:
+                total_size = self._stored_dir_size(path, computed)
+                self._index.set_sizes(computed)
+            except sqlite3.Error as exc:
+                self._debug("index", str(exc))
+            except OSError:
+                pass
+        elif self._options['dirSize']:
+            stack = [str(path)]
+            while stack:
+                try:
+                    with os.scandir(stack.pop()) as it:
+                        for entry in it:
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    stack.append(entry.path)
+                                elif entry.is_file():
+                                    total_size += entry.stat().st_size
+                            except OSError:
+                                continue
+                except OSError:
+                    continue
         else:
-            total_size = Path(path).stat().st_size
+            total_size = self._stat(path).st_size
 
         return total_size
 
+    def _stored_dir_size(self, path: Path, computed: list) -> int:
+        """ Return recursive size of directory, reusing aggregates stored for unchanged directories. """
+        mtime_ns = self._stat(path).st_mtime_ns
+        size = self._index.get_size(path, mtime_ns)
+        if size is not None:
+            return size
+
+        size = 0
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        size += self._stored_dir_size(Path(entry.path), computed)
+                    elif entry.is_file():
+                        size += entry.stat().st_size
+                except OSError:
+                    continue
+
+        computed.append((path, mtime_ns, size))
+        return size
+
     def _fbuffer(self, f, chunk_size=_options['uploadWriteChunk']):
         while True:
             chunk = f.read(chunk_size)
@@ -1088,47 +2139,32 @@ class Connector:
         else:
             return False
 
-    def _tmb_path(self, path: Path):
+    def _tmb_path(self, path: Path, stat: Optional[os.stat_result] = None):
         """ Generate path for thumbnail """
         tmb = ""
-        if self._options['tmbDir']:
-            if not path.parent == self._options['tmbDir']:
-                tmb = Path(self._options['tmbDir']).joinpath(f"{make_hash(str(path))}.png")
+        if self._options['tmbDir'] and not self._in_tmb_dir(path):
+            stat = stat or self._stat(path)
+            if stat is not None:
+                tmb = Path(thumbnail_path(self._options['tmbDir'], stat, self._options['tmbSize'], self._tmb_format()))
         return tmb
 
-    def _is_upload_allow(self, name: str) -> bool:
-        allow = False
-        deny = False
-        mime = self._mimetype(Path(name))
+    def _tmb_format(self) -> str:
+        return 'WEBP' if self._options['tmbFormat'] == 'webp' else 'PNG'
 
-        if 'all' in self._options['uploadAllow']:
-            allow = True
-        else:
-            for a in self._options['uploadAllow']:
-                if mime.find(a) == 0:
-                    allow = True
+    def _in_tmb_dir(self, path: Path) -> bool:
+        """ Check if path is thumbnails folder or lays inside it """
+        tmb_dir = self._options['tmbDir']
+        return bool(tmb_dir) and (path == tmb_dir or tmb_dir in path.parents)
 
-        if 'all' in self._options['uploadDeny']:
-            deny = True
-        else:
-            for d in self._options['uploadDeny']:
-                if mime.find(d) == 0:
-                    deny = True
+    def _is_upload_allow(self, name: str) -> bool:
+        mime = self._mimetype(Path(name))
+        allow = mime.startswith(self._upload_allow)
+        deny = mime.startswith(self._upload_deny)
 
         if self._options['uploadOrder'][0] == 'allow':  # ,deny
-            if deny is True:
-                return False
-            elif allow is True:
-                return True
-            else:
-                return False
+            return allow and not deny
         else:  # deny,allow
-            if allow is True:
-                return True
-            elif deny is True:
-                return False
-            else:
-                return True
+            return allow or not deny
 
     def _is_accepted(self, target: str) -> bool:
         if target in ('.', '..',):
@@ -1138,21 +2174,53 @@ class Connector:
 
         return True
 
+    def _stat(self, path: Path, entry: Optional[os.DirEntry] = None) -> Optional[os.stat_result]:
+        """ Return stat of path (following symlinks) memoized for the current request, None if it does not exist. """
+        key = str(path)
+        try:
+            return self._stats[key]
+        except KeyError:
+            pass
+
+        try:
+            stat = entry.stat() if entry is not None else os.stat(key)
+        except (OSError, ValueError):
+            stat = None
+
+        self._stats[key] = stat
+        return stat
+
+    def _forget(self, path: Path) -> None:
+        """ Drop memoized stat and access checks of path """
+        key = str(path)
+        self._stats.pop(key, None)
+        for mode in (os.R_OK, os.W_OK):
+            self._access.pop((key, mode), None)
+
+    def _os_access(self, path: Path, mode: int) -> bool:
+        """ Memoized os.access """
+        key = (str(path), mode)
+        try:
+            return self._access[key]
+        except KeyError:
+            allowed = self._access[key] = os.access(key[0], mode)
+            return allowed
+
     def _is_allowed(self, path: Path, access: str) -> bool:
         """ Check access rights (on read, write or remove) for path """
-        if not path.exists():
+        if self._stat(path) is None:
             return False
 
         if access == 'read':
-            if not os.access(path, os.R_OK):
+            if not self._os_access(path, os.R_OK):
                 self._set_error_data(str(path), access)
                 return False
         elif access == 'write':
-            if not os.access(path, os.W_OK):
+            if not self._os_access(path, os.W_OK):
                 self._set_error_data(str(path), access)
                 return False
         elif access == 'rm':
-            if not os.access(path.parent, os.R_OK):
+            if not self._os_access(path.parent, os.R_OK):
                 self._set_error_data(str(path), access)
                 return False
         else:
@@ -1174,36 +2242,55 @@ class Connector:
         self._error_data[path] = msg
 
     def _init_img_lib(self):
-        """ Try import image class from PIL, if 'imgLib' options is not set """
-        if not self._options['imgLib'] is False and self._im is None:
-            try:
-                from PIL import Image
-                self._im = Image
-                self._options['imgLib'] = 'PIL'
-            except ImportError:
-                self._im = False
-                self._options['imgLib'] = False
-                self._debug("ImgLib", "Cannot import 'Image' from PIL")
+        """ Return image library ('PIL') found when the connector was created, False if there is none """
+        self._debug("ImgLib", self._options['imgLib'])
+        return self._options['imgLib']
+
+    def _get_img_size(self, path: Path):
+        """ Get size of image by path. Return string value (WxH) of False value. """
+        stat = self._stat(path)
+        if stat is None:
+            return False
 
-            self._debug("ImgLib", self._options['imgLib'])
+        if self._dims is not None:
+            stored = self._dims_dirs.get(str(path.parent))
+            if stored is None:
+                try:
+                    stored = self._dims.get_dir(path.parent)
+                except sqlite3.Error as exc:
+                    self._debug("dims", str(exc))
+                    stored = {}
+                self._dims_dirs[str(path.parent)] = stored
+
+            cached = stored.get(path.name)
+            if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                return f"{cached[2]}x{cached[3]}"
+
+        dim = read_image_size(path)
+        if dim is None:
+            self._init_img_lib()
+            if self._im:
+                try:
+                    with self._im.open(path) as im:
+                        dim = im.size
+                except Exception:  # pylint: disable=broad-except
+                    pass
 
-            return self._options['imgLib']
+        if dim is None:
+            return False
 
-    def _get_img_size(self, path: str):
-        """ Get size of image by path. Return string value (WxH) of False value. """
-        self._init_img_lib()
-        if self._can_create_tmb():
+        if self._dims is not None:
             try:
-                im = self._im.open(path)
-                return f"{im.size[0]}x{im.size[1]}"
-            except:
-                pass
+                self._dims.set(path, stat.st_size, stat.st_mtime_ns, dim)
+            except sqlite3.Error as exc:
+                self._debug("dims", str(exc))
 
-        return False
+        return f"{dim[0]}x{dim[1]}"
 
     def _debug(self, key: str, val: Any) -> None:
         """ Add messages to debug dict """
-        if self._options[RSP_DEBUG]:
+        # plain text responses of open have no room for them
+        if self._options[RSP_DEBUG] and isinstance(self._response, dict):
             self._response[RSP_DEBUG].update(
                 {key: val, }
             )
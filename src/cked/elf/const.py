@@ -4,6 +4,7 @@
 # '''
 # # base requests constants
 API_CHUNK = 'chunk'
+API_CID = 'cid'
 API_CMD = 'cmd'
 API_CONTENT = 'content'
 API_CURRENT = 'current'
@@ -11,7 +12,13 @@ API_CUT = 'cut'
 API_DEST = 'dst'
 API_HEIGHT = 'height'
 API_INIT = 'init'
+API_JOB = 'job'
+API_LIMIT = 'limit'
 API_NAME = 'name'
+API_OFFSET = 'offset'
+API_ORDER = 'order'
+API_RANGE = 'range'
+API_SORT = 'sort'
 API_SRC = 'src'
 API_TARGET = 'target'
 API_TARGETS = 'targets[]'
@@ -25,6 +32,7 @@ RSP_CONTENT = 'content'
 RSP_DEBUG = 'debug'
 RSP_ERROR = 'error'
 RSP_IMAGES = 'images'
+RSP_JOB = 'job'
 RSP_SELECT = 'select'
 
 ACCESS_READ = 'read'
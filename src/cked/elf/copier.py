@@ -0,0 +1,125 @@
+import errno
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl sharing the extents of a file (btrfs, XFS, bcachefs, ...), from linux/fs.h
+FICLONE = 0x40049409
+
+# errors meaning the file system or kernel cannot do this kind of copy, rather than a failed copy
+_unsupported = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+
+def _clone(src_fd: int, dest_fd: int) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, src_fd)
+        return True
+    except OSError as exc:
+        if exc.errno in _unsupported:
+            return False
+        raise
+
+
+def _copy_range(copy: Callable[[int, int, int, int], int], src_fd: int, dest_fd: int, size: int) -> bool:
+    offset = 0
+    while offset < size:
+        try:
+            sent = copy(src_fd, dest_fd, offset, size - offset)
+        except OSError as exc:
+            if offset == 0 and exc.errno in _unsupported:
+                return False
+            raise
+        if not sent:
+            break
+        offset += sent
+    return True
+
+
+def _copy_file_range(src_fd: int, dest_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dest_fd, count, offset, offset)
+
+
+def _sendfile(src_fd: int, dest_fd: int, offset: int, count: int) -> int:
+    return os.sendfile(dest_fd, src_fd, offset, count)
+
+
+def copy_file(src: Path, dest: Path) -> None:
+    """
+    Copy file content and permissions to a new file, letting the kernel do the work: reflink first, then
+    copy_file_range and sendfile, reading through user space only where none of them is available.
+    """
+    with open(src, 'rb') as fsrc, open(dest, 'xb') as fdst:
+        src_fd, dest_fd = fsrc.fileno(), fdst.fileno()
+        size = os.fstat(src_fd).st_size
+        if not (
+            _clone(src_fd, dest_fd)
+            or (hasattr(os, 'copy_file_range') and _copy_range(_copy_file_range, src_fd, dest_fd, size))
+            or (hasattr(os, 'sendfile') and _copy_range(_sendfile, src_fd, dest_fd, size))
+        ):
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    shutil.copymode(src, dest)
+
+
+def copy_tree(src: Path, dest: Path, copy_function: Callable[[Path, Path], None], pool: ThreadPoolExecutor,
+              progress: Optional[Callable[[], None]] = None) -> List[Tuple[str, str]]:
+    """
+    Recreate directory tree of src at dest and copy its files on pool. progress is called from the pool for
+    every finished file.
+    Return (path, error) of the files which could not be copied; the rest of the tree is copied regardless.
+    """
+    errors = []
+    jobs = []
+    stack = [(Path(src), Path(dest))]
+    while stack:
+        src_dir, dest_dir = stack.pop()
+        try:
+            dest_dir.mkdir()
+            shutil.copymode(src_dir, dest_dir)
+            with os.scandir(src_dir) as it:
+                entries = list(it)
+        except OSError as exc:
+            errors.append((str(src_dir), exc.strerror or str(exc)))
+            continue
+
+        for entry in entries:
+            src_path, dest_path = Path(entry.path), dest_dir.joinpath(entry.name)
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                stack.append((src_path, dest_path))
+            else:
+                job = pool.submit(copy_function, src_path, dest_path)
+                if progress is not None:
+                    job.add_done_callback(lambda _: progress())
+                jobs.append((src_path, job))
+
+    for src_path, job in jobs:
+        try:
+            job.result()
+        except OSError as exc:
+            errors.append((str(src_path), exc.strerror or str(exc)))
+    return errors
+
+
+_pools: Dict[int, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def get_copy_pool(workers: int) -> ThreadPoolExecutor:
+    """ Return process wide pool copying files. """
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cked-copy')
+        return _pools[workers]
@@ -0,0 +1,88 @@
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import uuid
+from pathlib import Path
+
+
+def file_digest(path: Path) -> str:
+    """ Return sha256 of file content, read through mmap. """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+    return h.hexdigest()
+
+
+class BlobStore:
+    """
+    One hardlinked blob per distinct content. Files with the same content are links to the blob, so they
+    share storage until one of them is changed.
+    """
+
+    def __init__(self, base: Path) -> None:
+        self.base = Path(base)
+
+    def path(self, digest: str) -> Path:
+        return self.base.joinpath(digest[0:2], digest[2:4], digest)
+
+    def link(self, path: Path, digest: str) -> bool:
+        """ Make path a link to the blob of digest, or the blob itself if there is none. Return True if shared. """
+        blob = self.path(digest)
+        try:
+            stat = path.stat()
+            blob_stat = blob.stat()
+        except FileNotFoundError:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(path, blob)
+            except FileExistsError:
+                # stored by a parallel upload in the meantime
+                return self.link(path, digest)
+            return False
+
+        if blob_stat.st_ino == stat.st_ino or blob_stat.st_size != stat.st_size:
+            return blob_stat.st_ino == stat.st_ino
+        if blob_stat.st_mode != stat.st_mode:
+            # links share permissions, keep a copy with different ones
+            return False
+
+        # os.link does not replace, so the name has to be free: unique per thread and process
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.link")
+        try:
+            os.link(blob, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return True
+
+    def release(self, digest: str) -> None:
+        """ Remove blob which is not linked from any file anymore. """
+        blob = self.path(digest)
+        try:
+            if blob.stat().st_nlink == 1:
+                blob.unlink()
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def unshare(path: Path) -> bool:
+        """ Give path its own copy of the content before it is changed in place. Return True if it was shared. """
+        if path.stat().st_nlink < 2:
+            return False
+
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.unshare')
+        os.close(fd)
+        tmp_path = Path(tmp_path)
+        try:
+            shutil.copy2(path, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return True
+
@@ -0,0 +1,90 @@
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from .index import Store
+
+
+def read_image_size(path: Path) -> Optional[Tuple[int, int]]:
+    """ Read (width, height) from PNG, GIF, JPEG or WebP header without decoding the image. """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(32)
+
+            if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+                return struct.unpack('>II', head[16:24])
+
+            if head[:6] in (b'GIF87a', b'GIF89a'):
+                return struct.unpack('<HH', head[6:10])
+
+            if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                return _webp_size(head)
+
+            if head[:2] == b'\xff\xd8':
+                f.seek(2)
+                return _jpeg_size(f)
+    except (OSError, IndexError, struct.error):
+        pass
+
+    return None
+
+
+def _webp_size(head: bytes) -> Optional[Tuple[int, int]]:
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+        w, h = struct.unpack('<HH', head[26:30])
+        return w & 0x3fff, h & 0x3fff
+    if chunk == b'VP8L' and head[20:21] == b'\x2f':
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b'VP8X':
+        return int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+    return None
+
+
+def _jpeg_size(f) -> Optional[Tuple[int, int]]:
+    # walk segments up to the first start-of-frame marker
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        code = marker[1]
+        while code == 0xff:  # fill bytes
+            code = f.read(1)[0]
+        if code in (0x01, 0xd8) or 0xd0 <= code <= 0xd7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+class DimensionCache(Store):
+    """ Image dimensions keyed by file path, size and modification time. """
+
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS dims ("
+        " dir TEXT NOT NULL,"
+        " name TEXT NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " mtime_ns INTEGER NOT NULL,"
+        " width INTEGER NOT NULL,"
+        " height INTEGER NOT NULL,"
+        " PRIMARY KEY (dir, name)"
+        ")",
+    )
+
+    def get_dir(self, dir_path: Path) -> Dict[str, Tuple[int, int, int, int]]:
+        """ Return {name: (size, mtime_ns, width, height)} for all images stored for directory. """
+        rows = self._connect().execute(
+            "SELECT name, size, mtime_ns, width, height FROM dims WHERE dir = ?", (str(dir_path),)
+        )
+        return {name: (size, mtime_ns, width, height) for name, size, mtime_ns, width, height in rows}
+
+    def set(self, path: Path, size: int, mtime_ns: int, dim: Tuple[int, int]) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO dims (dir, name, size, mtime_ns, width, height) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(path.parent), path.name, size, mtime_ns, dim[0], dim[1])
+        )
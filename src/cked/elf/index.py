@@ -0,0 +1,242 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from .utils import make_hash
+
+
+class Store:
+    """ SQLite database with one connection per thread, opened on first use. """
+
+    _schema = ()
+
+    def __init__(self, db_path: Path) -> None:
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+
+    def open(self) -> None:
+        """ Connect the current thread, raising sqlite3.Error if the database can not be created. """
+        self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        """ Return connection for the current thread. """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid != os.getpid():
+            # inherited from the parent by fork, SQLite connections must not be shared with it
+            conn = None
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self._schema:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            if self._local.pid == os.getpid():
+                conn.close()
+            self._local.conn = None
+
+
+class Index(Store):
+    """ Persistent hash -> root-relative path mapping, directory sizes and file digests stored in SQLite. """
+
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS paths ("
+        " hash TEXT PRIMARY KEY,"
+        " rel TEXT NOT NULL"
+        ")",
+        "CREATE INDEX IF NOT EXISTS paths_rel ON paths (rel)",
+        "CREATE TABLE IF NOT EXISTS sizes ("
+        " rel TEXT PRIMARY KEY,"
+        " mtime_ns INTEGER NOT NULL,"
+        " size INTEGER NOT NULL"
+        ")",
+        "CREATE TABLE IF NOT EXISTS contents ("
+        " rel TEXT PRIMARY KEY,"
+        " ino INTEGER NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " mtime_ns INTEGER NOT NULL,"
+        " digest TEXT NOT NULL"
+        ")",
+        "CREATE TABLE IF NOT EXISTS meta ("
+        " key TEXT PRIMARY KEY,"
+        " value INTEGER NOT NULL"
+        ")",
+    )
+
+    def __init__(self, db_path: Path, root: Path) -> None:
+        self.root = Path(root)
+        super().__init__(db_path)
+
+    def rel(self, path: Path) -> str:
+        """ Return path relative to root ('' for root itself). """
+        rel = os.path.relpath(str(path), str(self.root))
+        return '' if rel == '.' else rel
+
+    def get(self, fhash: str) -> Optional[Path]:
+        """ Return path stored for hash or None. """
+        row = self._connect().execute("SELECT rel FROM paths WHERE hash = ?", (fhash,)).fetchone()
+        if row is None:
+            return None
+        return self.root.joinpath(row[0]) if row[0] else self.root
+
+    def add(self, path: Path) -> None:
+        """ Register single path. """
+        self.add_many([path])
+
+    def add_many(self, paths: Iterable[Path]) -> None:
+        """ Register several paths in one transaction. """
+        rows = [(make_hash(str(p)), self.rel(p)) for p in paths]
+        if not rows:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR REPLACE INTO paths (hash, rel) VALUES (?, ?)", rows)
+
+    def move(self, src: Path, dest: Path) -> None:
+        """ Carry content digests of path and everything below it over to its new location. """
+        src_rel, dest_rel = self.rel(src), self.rel(dest)
+        prefix = src_rel.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "UPDATE OR REPLACE contents SET rel = ? || substr(rel, ?) WHERE rel = ? OR rel LIKE ? ESCAPE '\\'",
+                (dest_rel, len(src_rel) + 1, src_rel, f"{prefix}{os.sep}%")
+            )
+
+    def remove(self, path: Path) -> None:
+        """ Forget path and everything below it. """
+        rel = self.rel(path)
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            if not rel:
+                conn.execute("DELETE FROM paths")
+                conn.execute("DELETE FROM sizes")
+                conn.execute("DELETE FROM contents")
+                return
+            prefix = rel.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            for table in ('paths', 'sizes', 'contents'):
+                conn.execute(
+                    f"DELETE FROM {table} WHERE rel = ? OR rel LIKE ? ESCAPE '\\'",
+                    (rel, f"{prefix}{os.sep}%")
+                )
+
+    def get_size(self, path: Path, mtime_ns: int) -> Optional[int]:
+        """ Return recursive size stored for directory if it was computed at the given mtime. """
+        row = self._connect().execute(
+            "SELECT size FROM sizes WHERE rel = ? AND mtime_ns = ?", (self.rel(path), mtime_ns)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set_sizes(self, sizes: Iterable[Tuple[Path, int, int]]) -> None:
+        """ Store (path, mtime_ns, size) directory aggregates. """
+        rows = [(self.rel(p), mtime_ns, size) for p, mtime_ns, size in sizes]
+        if not rows:
+            return
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR REPLACE INTO sizes (rel, mtime_ns, size) VALUES (?, ?, ?)", rows)
+
+    def invalidate_sizes(self, path: Path) -> None:
+        """ Drop size aggregates of directory and all its ancestors. """
+        rel = self.rel(path)
+        rels = ['']
+        if rel and not rel.startswith('..'):
+            parts = rel.split(os.sep)
+            rels.extend(os.sep.join(parts[:i]) for i in range(1, len(parts) + 1))
+        conn = self._connect()
+        conn.execute(f"DELETE FROM sizes WHERE rel IN ({', '.join('?' * len(rels))})", rels)
+
+    def get_digest(self, path: Path, stat: os.stat_result) -> Optional[str]:
+        """ Return content digest stored for file if it was computed for the same inode, size and mtime. """
+        row = self._connect().execute(
+            "SELECT digest FROM contents WHERE rel = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+            (self.rel(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set_digest(self, path: Path, stat: os.stat_result, digest: str) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO contents (rel, ino, size, mtime_ns, digest) VALUES (?, ?, ?, ?, ?)",
+            (self.rel(path), stat.st_ino, stat.st_size, stat.st_mtime_ns, digest)
+        )
+
+    def generation(self) -> int:
+        """ Return counter of modifications made through the connector. """
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return 0 if row is None else row[0]
+
+    def bump_generation(self) -> None:
+        self._connect().execute(
+            "INSERT INTO meta (key, value) VALUES ('generation', 1)"
+            " ON CONFLICT (key) DO UPDATE SET value = value + 1"
+        )
+
+    def claim_rebuild(self, interval: int) -> bool:
+        """ Return True if no rebuild was started in the last interval seconds, recording this one. """
+        now = int(time.time())
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('rebuilt', 0)")
+            cursor = conn.execute(
+                "UPDATE meta SET value = ? WHERE key = 'rebuilt' AND value <= ?", (now, now - interval)
+            )
+        return cursor.rowcount == 1
+
+    @staticmethod
+    def _walk_dirs(top: Path, dot_files: bool) -> List[str]:
+        """ Return paths of directories below top, without symlinks and, unless dot_files, dot directories. """
+        found = []
+        stack = [str(top)]
+        while stack:
+            cur = stack.pop()
+            try:
+                with os.scandir(cur) as it:
+                    for entry in it:
+                        if entry.name[0:1] == '.' and not dot_files:
+                            # thumbnails, blobs and upload parts are sharded into many folders
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                found.append(entry.path)
+                                stack.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        return found
+
+    def add_tree(self, path: Path, dot_files: bool = False) -> None:
+        """ Register directory and the directories below it. """
+        self.add_many([Path(path)] + [Path(p) for p in self._walk_dirs(path, dot_files)])
+
+    def rebuild(self, dot_files: bool = False) -> int:
+        """ Drop stale entries and register every directory under root. Return number of directories. """
+        rows = [(make_hash(str(self.root)), '')]
+        rows.extend((make_hash(p), self.rel(p)) for p in self._walk_dirs(self.root, dot_files))
+
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM paths")
+            conn.executemany("INSERT OR REPLACE INTO paths (hash, rel) VALUES (?, ?)", rows)
+            # files are registered by listing them: cached listings have to be built again
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('generation', 1)"
+                " ON CONFLICT (key) DO UPDATE SET value = value + 1"
+            )
+
+        return len(rows)
@@ -0,0 +1,156 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .index import Store
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class JobStore(Store):
+    """ Background jobs of the connector: their progress, per-file errors and final response. """
+
+    _schema = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " id TEXT PRIMARY KEY,"
+        " cmd TEXT NOT NULL,"
+        " state TEXT NOT NULL,"
+        " pid INTEGER NOT NULL,"
+        " total INTEGER NOT NULL DEFAULT 0,"
+        " done INTEGER NOT NULL DEFAULT 0,"
+        " errors TEXT NOT NULL DEFAULT '{}',"
+        " result TEXT,"
+        " updated REAL NOT NULL"
+        ")",
+    )
+
+    def create(self, cmd: str, max_age: int) -> str:
+        """ Register queued job, dropping finished jobs older than max_age seconds. Return its id. """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?) AND updated < ?", (JOB_DONE, JOB_FAILED, now - max_age)
+            )
+            conn.execute(
+                "INSERT INTO jobs (id, cmd, state, pid, updated) VALUES (?, ?, ?, ?, ?)",
+                (job_id, cmd, JOB_QUEUED, os.getpid(), now)
+            )
+        return job_id
+
+    def start(self, job_id: str, total: int) -> None:
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, total = ?, updated = ? WHERE id = ?", (JOB_RUNNING, total, time.time(), job_id)
+        )
+
+    def progress(self, job_id: str, done: int) -> None:
+        self._connect().execute("UPDATE jobs SET done = ?, updated = ? WHERE id = ?", (done, time.time(), job_id))
+
+    def finish(self, job_id: str, state: str, done: int, errors: Dict[str, str], result: Optional[str]) -> None:
+        """ Store outcome of job; result is the JSON encoded response of its command. """
+        self._connect().execute(
+            "UPDATE jobs SET state = ?, done = ?, errors = ?, result = ?, updated = ? WHERE id = ?",
+            (state, done, json.dumps(errors), result, time.time(), job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """ Return job as dict or None if it is not known. """
+        row = self._connect().execute(
+            "SELECT id, cmd, state, pid, total, done, errors, result FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(('id', 'cmd', 'state', 'pid', 'total', 'done', 'errors', 'result'), row))
+        job['errors'] = json.loads(job['errors'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        if job['state'] in (JOB_QUEUED, JOB_RUNNING) and not _alive(job['pid']):
+            job['state'] = JOB_FAILED
+            job['errors'].setdefault('', "Interrupted")
+        return job
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid() or os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class JobProgress:
+    """ Files processed by the running job, written to the store at most every interval seconds. """
+
+    def __init__(self, store: JobStore, job_id: str, interval: float = 0.5) -> None:
+        self.store = store
+        self.job_id = job_id
+        self.interval = interval
+        self.done = 0
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start(self, total: int) -> None:
+        self.store.start(self.job_id, total)
+
+    def add(self, count: int = 1) -> None:
+        """ Count processed files, also called from the threads copying files for the job. """
+        with self._lock:
+            self.done += count
+            now = time.monotonic()
+            if now - self._flushed < self.interval:
+                return
+            self._flushed = now
+            done = self.done
+        self.store.progress(self.job_id, done)
+
+
+# job run by the current thread, None while handling a request
+current_job: ContextVar[Optional[JobProgress]] = ContextVar('cked_current_job', default=None)
+
+
+def count_files(path: Path) -> int:
+    """ Return number of files in tree, 1 for a file. """
+    if not path.is_dir():
+        return 1
+    count = 0
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            stack.append(entry.path)
+                        else:
+                            count += 1
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return count
+
+
+_pools: Dict[int, ThreadPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def get_job_pool(workers: int) -> ThreadPoolExecutor:
+    """ Return process wide pool running background jobs. """
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cked-job')
+        return _pools[workers]
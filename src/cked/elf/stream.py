@@ -0,0 +1,82 @@
+import json
+from collections.abc import Iterator
+from typing import Any, Dict, Iterable
+
+
+class Entry:
+    """ File info of a listing; keys which were not set are left out of the JSON. """
+
+    __slots__ = (
+        'name', 'hash', 'mime', 'date', 'size', 'read', 'write', 'rm',
+        'parent', 'link', 'linkTo', 'url', 'dim', 'resize', 'tmb',
+    )
+
+    def __init__(self, **kwargs: Any) -> None:
+        for key in self.__slots__:
+            setattr(self, key, kwargs.get(key))
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state) -> None:
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        info = {}
+        for key in self.__slots__:
+            value = getattr(self, key)
+            if value is not None:
+                info[key] = value
+        return info
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Entry):
+        return obj.as_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def iter_json(response: Dict[str, Any], chunk_size: int = 65536) -> Iterable[str]:
+    """
+    Serialize connector response piece by piece. Iterators (streamed listings) are written as arrays after
+    the other keys; keys the response gained while they were consumed are written at the end.
+    """
+    encode = json.JSONEncoder(default=_default).encode
+    buf = []
+    buf_size = 0
+    written = set()
+    streams = []
+
+    def members(items):
+        for key, value in items:
+            written.add(key)
+            yield f"{', ' if len(written) > 1 else ''}{encode(key)}: "
+            if isinstance(value, Iterator):
+                yield '['
+                for i, item in enumerate(value):
+                    yield f"{', ' if i else ''}{encode(item)}"
+                yield ']'
+            else:
+                yield encode(value)
+
+    def chunks():
+        yield '{'
+        plain = []
+        for key, value in list(response.items()):
+            (streams if isinstance(value, Iterator) else plain).append((key, value))
+        yield from members(plain)
+        yield from members(streams)
+        yield from members([(k, v) for k, v in list(response.items()) if k not in written])
+        yield '}'
+
+    for part in chunks():
+        buf.append(part)
+        buf_size += len(part)
+        if buf_size >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            buf_size = 0
+
+    if buf:
+        yield ''.join(buf)
@@ -0,0 +1,340 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Set, Tuple
+
+from .utils import crop_tuple, make_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def resample_filter(name: str) -> int:
+    """ Return PIL resampling filter by name ('nearest', 'box', 'bilinear', 'hamming', 'bicubic', 'lanczos'). """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    return getattr(Image, str(name).upper(), Image.LANCZOS)
+
+
+# mode of new files, mkstemp creates them readable by the owner only
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def _save_temp(im, path: str, fmt: str, **options) -> str:
+    """ Save image to a new temporary file next to path, unique between threads and processes. """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=f".{os.path.basename(path)}.",
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            im.save(f, fmt, **options)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o666 & ~_umask)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path
+
+
+def _save_atomic(im, path: str, fmt: str) -> None:
+    tmp_path = _save_temp(im, path, fmt)
+    try:
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def thumbnail_path(tmb_dir, stat: os.stat_result, size: int, fmt: str = 'PNG') -> str:
+    """ Return thumbnail path keyed by file identity and state, so renames and moves keep their thumbnails. """
+    key = make_hash(f"{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}:{size}")
+    ext = 'webp' if fmt == 'WEBP' else 'png'
+    return os.path.join(str(tmb_dir), key[0:2], key[2:4], f"{key}.{ext}")
+
+
+def _displayable(im):
+    """ Convert image to a mode every thumbnail format can store. """
+    if im.mode in ('RGB', 'RGBA', 'L', 'LA'):
+        return im
+    if im.mode in ('I', 'F') or im.mode.startswith('I;16'):
+        # high bit depth greyscale, stretched into 8 bits
+        im = im.convert('F' if im.mode == 'F' else 'I')
+        low, high = im.getextrema()
+        scale = 255 / ((high - low) or 1)
+        return im.point(lambda v: (v - low) * scale).convert('L')
+    if im.mode == '1':
+        return im.convert('L')
+    if 'A' in im.getbands() or 'a' in im.getbands() or 'transparency' in im.info:
+        return im.convert('RGBA')
+    return im.convert('RGB')
+
+
+def _square(im, size: int, resample: str):
+    box = crop_tuple(im.size)
+    if box:
+        im = im.crop(box)
+
+    if im.mode in ('1', 'P') or im.mode.startswith('I;16'):
+        # modes reduce() does not take: bilevel, palette (GIF, PNG8) and 16 bit greyscale
+        im = _displayable(im)
+
+    # cheap integer downscale, leaving twice the target for the resampling filter
+    factor = min(im.size) // (size * 2)
+    if factor > 1:
+        im = im.reduce(factor)
+    if im.size[0] > size:
+        im = im.resize((size, size), resample_filter(resample))
+    return _displayable(im)
+
+
+def _save_thumbnail(im, tmb_path: str, fmt: str) -> None:
+    os.makedirs(os.path.dirname(tmb_path), exist_ok=True)
+    _save_atomic(im, tmb_path, fmt)
+
+
+def make_thumbnail(path: str, tmb_path: str, size: int, resample: str = 'lanczos', fmt: str = 'PNG') -> bool:
+    """ Create square thumbnail of image, written atomically to tmb_path. """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    with Image.open(path) as im:
+        # JPEG decoder scales down by 1/2, 1/4 or 1/8 while decoding, keeping both sides >= size
+        im.draft(None, (size, size))
+        _save_thumbnail(_square(im, size, resample), tmb_path, fmt)
+
+    return True
+
+
+def _unchanged(path: str, expected: Optional[Tuple[int, int]]) -> bool:
+    """ Check file still has the expected (size, mtime_ns), if any. """
+    if expected is None:
+        return True
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return (stat.st_size, stat.st_mtime_ns) == tuple(expected)
+
+
+def process_image(
+        path: str, max_size: int = 0, quality: int = 85, tmb_dir: Optional[str] = None, tmb_size: int = 48,
+        resample: str = 'lanczos', tmb_fmt: str = 'PNG', dims_db: Optional[str] = None,
+        index_db: Optional[str] = None, root: Optional[str] = None, expected: Optional[Tuple[int, int]] = None
+) -> bool:
+    """
+    Rewrite uploaded JPEG, PNG or WebP image in place: apply EXIF orientation, drop metadata except the color
+    profile, fit into max_size and recompress (JPEG and WebP at quality, PNG losslessly). The original is kept
+    if nothing changed and the result is not smaller. Thumbnail and dimensions come from the same decode.
+    A replaced image invalidates the directory sizes stored in the index at index_db.
+    Animations are left alone, and so is a file which no longer has the expected (size, mtime_ns): it was
+    uploaded again, edited or moved since the job was queued.
+    """
+    from PIL import Image, ImageOps  # pylint: disable=import-outside-toplevel
+
+    if not _unchanged(path, expected):
+        return False
+
+    with Image.open(path) as original:
+        fmt = original.format
+        if fmt not in ('JPEG', 'PNG', 'WEBP') or getattr(original, 'is_animated', False):
+            # only the first frame would be kept
+            return False
+        original_size = original.size
+        if max_size and fmt == 'JPEG':
+            original.draft(None, (max_size, max_size))
+
+        icc_profile = original.info.get('icc_profile')
+        has_metadata = bool(original.getexif()) or any(k in original.info for k in ('exif', 'xmp', 'comment'))
+        im = ImageOps.exif_transpose(original)
+        changed = has_metadata or im.size != original_size
+        if max_size and max(im.size) > max_size:
+            im.thumbnail((max_size, max_size), resample_filter(resample), reducing_gap=2.0)
+            changed = True
+
+        options = {'icc_profile': icc_profile} if icc_profile else {}
+        if fmt == 'JPEG':
+            options.update(quality=quality, optimize=True, progressive=True)
+        elif fmt == 'PNG':
+            options.update(optimize=True)
+        else:
+            options.update(quality=quality, method=6)
+
+        size = os.stat(path).st_size
+        tmp_path = _save_temp(im, path, fmt, **options)
+        replaced = False
+        try:
+            if not _unchanged(path, expected):
+                return False
+            if changed or os.stat(tmp_path).st_size < size:
+                os.replace(tmp_path, path)
+                replaced = True
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        stat = os.stat(path)
+        if tmb_dir:
+            _save_thumbnail(_square(im, tmb_size, resample), thumbnail_path(tmb_dir, stat, tmb_size, tmb_fmt), tmb_fmt)
+
+    if dims_db:
+        from .images import DimensionCache  # pylint: disable=import-outside-toplevel
+
+        dims = DimensionCache(dims_db)
+        try:
+            dims.set(Path(path), stat.st_size, stat.st_mtime_ns, im.size)
+        finally:
+            dims.close()
+
+    if replaced and index_db:
+        from .index import Index  # pylint: disable=import-outside-toplevel
+
+        index = Index(index_db, root)
+        try:
+            index.invalidate_sizes(Path(path).parent)
+            # listings of the ancestors carry the old size
+            index.bump_generation()
+        finally:
+            index.close()
+
+    return True
+
+
+def resize_image(path: str, width: int, height: int, resample: str = 'lanczos') -> None:
+    """ Scale image in place to width x height. """
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    with Image.open(path) as im:
+        fmt = im.format
+        im.draft(None, (width * 2, height * 2))
+        resized = im.resize((width, height), resample_filter(resample), reducing_gap=2.0)
+
+    _save_atomic(resized, path, fmt)
+
+
+_key_locks = [threading.Lock() for _ in range(64)]
+
+
+@contextmanager
+def _thumbnail_lock(tmb_path: str):
+    """ Serialize creation of one thumbnail between threads and, where flock is available, processes. """
+    with _key_locks[hash(tmb_path) % len(_key_locks)]:
+        if fcntl is None:
+            yield
+            return
+
+        os.makedirs(os.path.dirname(tmb_path), exist_ok=True)
+        lock_path = f"{tmb_path}.lock"
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+            try:
+                os.unlink(lock_path)
+            except OSError:
+                pass
+        finally:
+            os.close(fd)
+
+
+def ensure_thumbnail(path: str, tmb_path: str, size: int, resample: str = 'lanczos', fmt: str = 'PNG') -> bool:
+    """ Create thumbnail unless it exists, letting concurrent callers wait for a single creation. """
+    if os.path.exists(tmb_path):
+        return True
+
+    with _thumbnail_lock(tmb_path):
+        if os.path.exists(tmb_path):
+            return True
+        return make_thumbnail(path, tmb_path, size, resample, fmt)
+
+
+def _mp_context():
+    """
+    Start workers from a clean process: the pool is created by a request thread, and forking a process
+    with other threads running can leave locks held in the child.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class ThumbnailScheduler:
+    """ Generate thumbnails and process images in a pool of worker processes, one job per target at a time. """
+
+    def __init__(self, workers: int, max_pending: Optional[int] = None) -> None:
+        self.workers = workers
+        self.max_pending = max_pending or workers * 64
+        self._executor = None
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._failed: Set[str] = set()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+        return self._executor
+
+    def submit(self, path: str, tmb_path: str, size: int, resample: str = 'lanczos', fmt: str = 'PNG') -> bool:
+        """ Queue thumbnail unless it is already queued. Return False if the queue is full. """
+        return self._submit(tmb_path, make_thumbnail, path, tmb_path, size, resample, fmt)
+
+    def submit_image(self, path: str, **kwargs) -> bool:
+        """ Queue process_image of uploaded image. Return False if the queue is full. """
+        # a file uploaded again while the job of the previous one is pending gets a job of its own
+        return self._submit(f"{path}\0{kwargs.get('expected')}", process_image, path, **kwargs)
+
+    def _submit(self, key: str, fn, *args, **kwargs) -> bool:
+        with self._lock:
+            if key in self._inflight:
+                return True
+            if len(self._inflight) >= self.max_pending:
+                return False
+            try:
+                future = self._get_executor().submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                self._executor = None
+                return False
+            self._inflight[key] = future
+
+        future.add_done_callback(lambda f: self._done(key, f))
+        return True
+
+    def _done(self, key: str, future: Future) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                self._failed.add(key)
+
+    def failed(self, tmb_path: str) -> bool:
+        """ Check if thumbnail could not be created by this scheduler. """
+        with self._lock:
+            return tmb_path in self._failed
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._inflight)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_schedulers: Dict[int, ThumbnailScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(workers: int) -> ThumbnailScheduler:
+    """ Return process wide scheduler for given pool size. """
+    with _schedulers_lock:
+        if workers not in _schedulers:
+            _schedulers[workers] = ThumbnailScheduler(workers)
+        return _schedulers[workers]
@@ -1,9 +1,13 @@
 
+import base64
 import hashlib
+import hmac
+import os
 import re
 import traceback
 from pathlib import Path
 from typing import List, Optional, Tuple, Union
+from urllib.parse import quote
 
 
 def crop_tuple(size: Tuple[int, int]) -> Optional[Tuple[int, int, int, int]]:
@@ -34,19 +38,26 @@ def exception_to_string(e: Exception) -> str:
     return f"{pretty_out}\n {e.__class__} {e}"
 
 
-def read_link(path: Path) -> Union[bool, Path]:
-    """ Read link and return real path if not broken """
+def read_link(path: Path, root: str) -> Union[bool, Path]:
+    """ Read link and return real path if not broken and inside root """
     target = path.readlink()
     if not str(target)[0] == '/':
         target = path.parent.joinpath(target)
     target = target.resolve(strict=False)
 
     if target.exists():
-        if not str(target).find(self._options['root']) == -1:
-            return target
+        real_root = Path(root).resolve()
+        if target == real_root or real_root in target.parents:
+            # spelled from root, as every other path of the connector
+            return Path(root).joinpath(target.relative_to(real_root))
     return False
 
 
+def natural_key(name: str) -> List[Union[int, str]]:
+    """ Sort key ordering numbers inside names by value ("img2" < "img10"). """
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
 def make_hash(to_hash: str) -> str:
     """ Return a hash of to_hash. """
     new_hash = hashlib.md5()
@@ -54,9 +65,72 @@ def make_hash(to_hash: str) -> str:
     return str(new_hash.hexdigest())
 
 
+hash_re = re.compile(r'^[0-9a-f]{32}$')
+
+
+def is_hash(value: str) -> bool:
+    """ Check value looks like a hash made by make_hash. """
+    return bool(hash_re.match(value))
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _path_signature(rel: str, secret: str) -> str:
+    digest = hmac.new(secret.encode('utf-8'), rel.encode('utf-8', 'surrogateescape'), hashlib.sha256).digest()
+    return _b64encode(digest[:12])
+
+
+def encode_path_id(rel: str, secret: str, prefix: str = 'l1_') -> str:
+    """ Return signed, URL-safe identifier of root-relative path. """
+    rel = rel.replace(os.sep, '/')
+    return f"{prefix}{_b64encode(rel.encode('utf-8', 'surrogateescape'))}.{_path_signature(rel, secret)}"
+
+
+def decode_path_id(path_id: str, secret: str, prefix: str = 'l1_') -> Optional[str]:
+    """ Return root-relative path from identifier made by encode_path_id or None if it is invalid. """
+    if not path_id.startswith(prefix) or '.' not in path_id:
+        return None
+    encoded, signature = path_id[len(prefix):].rsplit('.', 1)
+    try:
+        rel = _b64decode(encoded).decode('utf-8', 'surrogateescape')
+    except ValueError:
+        return None
+
+    if not hmac.compare_digest(signature, _path_signature(rel, secret)):
+        return None
+    if '\0' in rel or rel.startswith('/') or (os.sep != '/' and os.sep in rel):
+        return None
+    if rel and any(part in ('', '.', '..') for part in rel.split('/')):
+        return None
+
+    return rel
+
+
+def content_disposition(as_attachment: bool, filename: str) -> str:
+    """ Return Content-Disposition header value (RFC 6266), with filename* for names which are not ASCII. """
+    disposition = 'attachment' if as_attachment else 'inline'
+    try:
+        filename.encode('ascii')
+    except UnicodeEncodeError:
+        return f"{disposition}; filename*=utf-8''{quote(filename, safe='')}"
+    escaped = filename.replace('\\', '\\\\').replace('"', '\\"')
+    return f'{disposition}; filename="{escaped}"'
+
+
 def make_unique_name(path: Path, copy: str = " copy") -> Path:
     """ Generate unique name for file copied file. """
     cur_dir = path.parent
+    # one listing instead of an exists() call per candidate
+    try:
+        taken = set(os.listdir(cur_dir))
+    except OSError:
+        taken = set()
     cur_name = path.name
     last_dot = cur_name.rfind(".")
     ext = new_name = ""
@@ -85,9 +159,8 @@ def make_unique_name(path: Path, copy: str = " copy") -> Path:
         new_name = old_name[0:pos]
     else:
         # new_path = os.path.join(cur_dir, new_name + ext)
-        new_path = cur_dir.joinpath(f"{new_name}{ext}")
-        if not new_path.exists():
-            return new_path
+        if f"{new_name}{ext}" not in taken:
+            return cur_dir.joinpath(f"{new_name}{ext}")
 
     # if we are here then copy already exists or making copy of copy
     # we will make new indexed copy *black magic*
@@ -97,8 +170,7 @@ def make_unique_name(path: Path, copy: str = " copy") -> Path:
     while True:
         idx += 1
         new_name_ext = new_name + " " + str(idx) + ext
-        new_path = Path(cur_dir).joinpath(new_name_ext)
-        if not new_path.exists():
-            return new_path
+        if new_name_ext not in taken:
+            return Path(cur_dir).joinpath(new_name_ext)
         # if idx >= 1000: break # possible loop
 
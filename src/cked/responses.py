@@ -0,0 +1,100 @@
+import os
+import re
+from pathlib import Path
+from urllib.parse import quote
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# headers of connector response which are not passed to the client
+skip_headers = ('file', 'content-length', 'connection', 'content-transfer-encoding')
+
+
+def file_etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int):
+    """ Return (start, end) of single byte range, None if there is no usable range and False if it is unsatisfiable. """
+    match = range_re.match(header.strip())
+    if not match:
+        # malformed or multiple ranges, serve the whole file
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    if start >= size:
+        return False
+    end = int(end) if end else size - 1
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def file_range_iter(path: Path, start: int, length: int, chunk_size: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def file_response(request, path: Path, headers: dict, options: dict):
+    """ Serve file with conditional GET, byte ranges or X-Sendfile/X-Accel-Redirect. """
+    stat = path.stat()
+    etag = file_etag(stat)
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        sendfile = options.get('sendfile')
+        byte_range = None
+        if not sendfile and 'HTTP_RANGE' in request.META:
+            if_range = request.META.get('HTTP_IF_RANGE')
+            if not if_range or if_range == etag:
+                byte_range = parse_range(request.META['HTTP_RANGE'], stat.st_size)
+
+        if sendfile:
+            # the web server sends the bytes and handles ranges itself
+            response = HttpResponse()
+            if sendfile == 'X-Accel-Redirect':
+                rel = os.path.relpath(str(path), options['root']).replace(os.sep, '/')
+                response[sendfile] = quote(f"{options.get('sendfileURL', '').rstrip('/')}/{rel}")
+            else:
+                response[sendfile] = str(path)
+        elif byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{stat.st_size}"
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                file_range_iter(path, start, end - start + 1, options.get('downloadChunk', 65536)), status=206
+            )
+            response['Content-Range'] = f"bytes {start}-{end}/{stat.st_size}"
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = FileResponse(open(path, 'rb'))
+
+        for name, value in headers.items():
+            if name.lower() not in skip_headers:
+                response[name] = value
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
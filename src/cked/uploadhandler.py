@@ -0,0 +1,103 @@
+import hashlib
+import io
+import tempfile
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+from .elf.const import API_UPLOAD
+
+
+class ConnectorUploadedFile(UploadedFile):
+    """
+    File written by ConnectorUploadHandler; ``rejected`` holds the reason if its data was dropped, ``digest`` the
+    sha256 of its content when the connector deduplicates files.
+    """
+
+    def __init__(self, file, name, content_type, size, charset, rejected=None, content_type_extra=None,
+                 digest=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.rejected = rejected
+        self.digest = digest
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # the connector moved the file into place
+            pass
+
+
+class ConnectorUploadHandler(FileUploadHandler):
+    """
+    Write files of an elFinder upload straight to a temporary file under the connector root, so the connector
+    only renames them. Files the connector would refuse are rejected from their headers, before any data is
+    stored, and a file is dropped as soon as the upload exceeds ``uploadMaxSize``.
+    """
+
+    def __init__(self, request=None, connector=None):
+        super().__init__(request)
+        self.connector = connector
+        self.max_size = connector.options['uploadMaxSize'] * 1024 * 1024
+        self.received = 0
+        self.active = False
+        self.rejected = None
+        self.file = None
+        self.hasher = None
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.active = False
+        if field_name != API_UPLOAD:
+            return
+
+        temp_dir = self.connector.upload_temp_dir()
+        if temp_dir is None:
+            return
+
+        self.active = True
+        self.rejected = self.connector.upload_rejection(file_name)
+        self.file = None
+        if self.rejected is None:
+            self.file = tempfile.NamedTemporaryFile(dir=temp_dir, prefix='upload-', suffix='.tmp')
+            # content is fingerprinted while it is written
+            self.hasher = hashlib.sha256() if self.connector.options['dedup'] else None
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+
+        if self.rejected is None:
+            # limit applies to the whole request, like in the connector
+            self.received += len(raw_data)
+            if self.received > self.max_size:
+                self.rejected = "File exceeds the maximum allowed filesize"
+                self.file.close()
+                self.file = None
+            else:
+                self.file.write(raw_data)
+                if self.hasher is not None:
+                    self.hasher.update(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+
+        self.active = False
+        if self.file is None:
+            return ConnectorUploadedFile(
+                io.BytesIO(), self.file_name, self.content_type, 0, self.charset, self.rejected,
+                self.content_type_extra
+            )
+
+        self.file.flush()
+        self.file.seek(0)
+        return ConnectorUploadedFile(
+            self.file, self.file_name, self.content_type, file_size, self.charset, None, self.content_type_extra,
+            self.hasher.hexdigest() if self.hasher is not None else None
+        )
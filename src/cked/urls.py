@@ -4,5 +4,7 @@ from . import views
 
 urlpatterns = [
     path('elfinder/', views.elfinder, name='cked_elfinder'),
-    path('elfinder/connector/', views.elfinder_connector, name='cked_elfinder_connector')
+    path('elfinder/connector/', views.elfinder_connector, name='cked_elfinder_connector'),
+    path('elfinder/connector/async/', views.elfinder_connector_async, name='cked_elfinder_connector_async'),
+    path('elfinder/thumbnail/<str:target>/', views.elfinder_thumbnail, name='cked_elfinder_thumbnail'),
 ]
@@ -1,15 +1,31 @@
 
+from django.apps import apps
 from django.conf import settings
-from django.http import HttpResponse
+from django.core.cache import caches
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+import asyncio
 import json
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import django
 
 from .conf import ELFINDER_DEFAULT_OPTIONS
+from .elf.cache import get_listing_cache
 from .elf.connector import Connector
+from .elf.const import API_UPLOAD
+from .elf.stream import iter_json
+from .responses import file_response
+from .uploadhandler import ConnectorUploadHandler
 from .widgets import json_encode
 
 
@@ -33,13 +49,90 @@ def elfinder(request):
     })
 
 
+def connector_options():
+    user_options = getattr(settings, 'ELFINDER_OPTIONS', None)
+    if not isinstance(user_options, dict):
+        raise ImproperlyConfigured('ELFINDER_OPTIONS setting must be a dictionary type.')
+
+    options = dict(user_options)
+    options.setdefault('hashSecret', settings.SECRET_KEY)
+
+    if options.get('tmbOnDemand') and not options.get('tmbURL'):
+        url = reverse('cked_elfinder_thumbnail', kwargs={'target': '0'})
+        options['tmbURL'] = url[:url.rindex('0/')]
+
+    return options
+
+
+def listing_cache(options):
+    alias = options.get('listingCache')
+    if not alias:
+        return None
+
+    return get_listing_cache(
+        alias, caches[alias], options.get('listingCacheSize', 256), options.get('listingCacheTimeout', 300)
+    )
+
+
+def build_connector():
+    options = connector_options()
+    try:
+        return Connector(options, listing_cache(options))
+    except ValueError as exc:
+        raise ImproperlyConfigured(f'ELFINDER_OPTIONS: {exc}') from exc
+
+
+def get_connector():
+    """ Connector shared by all requests, see CkedConfig. """
+    return apps.get_app_config('cked').get_connector()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def connector_executor():
+    """ Bounded thread pool running the blocking work of the async connector view. """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'ELFINDER_OPTIONS', {}).get('asyncWorkers', 4)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cked')
+        return _executor
+
+
+async def _iterate_in_executor(iterator, executor):
+    """ Read chunks of a synchronous response body in the executor. """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    end = object()
+    while True:
+        chunk = await loop.run_in_executor(executor, next, iterator, end)
+        if chunk is end:
+            break
+        yield chunk
+
+
+def _connector_in_executor(request):
+    """ Run the sync view in a thread of the executor, which Django does not clean up after requests. """
+    close_old_connections()
+    try:
+        return elfinder_connector(request)
+    finally:
+        close_old_connections()
+
+
 @csrf_exempt
 @login_required
 def elfinder_connector(request):
-    # elf = elFinder.connector(settings.ELFINDER_OPTIONS)
-    elf = Connector(settings.ELFINDER_OPTIONS)
+    elf = get_connector()
     req = {}
 
+    if request.method == 'POST':
+        # uploads go straight to the file system of the connector root
+        request.upload_handlers.insert(0, ConnectorUploadHandler(request, elf))
+
     if request.method == 'GET':
         form = request.GET
     else:
@@ -57,14 +150,62 @@ def elfinder_connector(request):
         up_files = {}
         for up in request.FILES.getlist('upload[]'):
             if up.name:
-                up_files[up.name] = up.file
+                up_files[up.name] = up
 
-        req[field] = up_files
+        req[API_UPLOAD] = up_files
+
+    etag = None
+    if request.method == 'GET':
+        etag = elf.listing_etag(req)
+        if etag is not None:
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                return not_modified
 
     status, header, response = elf.run(req)
 
-    if not response is None and status == 200:
-        if 'file' in response and isinstance(response['file'], file):
-            response['file'].close()
+    if status == 200 and 'file' in header:
+        return file_response(request, header['file'], header, elf.options)
+
+    # open of a missing or forbidden file answers with a message instead of a dict
+    if isinstance(response, dict) and any(isinstance(value, Iterator) for value in response.values()):
+        # streamListing: listing is serialized while it is read from the disk
+        http_response = StreamingHttpResponse(iter_json(response), content_type='application/json', status=status)
+    else:
+        http_response = HttpResponse(json.dumps(response), content_type='application/json', status=status)
+    if etag is not None:
+        http_response['ETag'] = etag
+        http_response['Cache-Control'] = 'private, no-cache'
+    return http_response
+
+
+async def elfinder_connector_async(request):
+    """
+    Connector for ASGI servers. The server receives the request body without a thread; parsing the form,
+    the command and reading of the response body run in a pool of ``asyncWorkers`` threads.
+    """
+    executor = connector_executor()
+    loop = asyncio.get_running_loop()
+    # a fresh context per call, the request state of the connector must not leak between requests
+    response = await loop.run_in_executor(executor, copy_context().run, _connector_in_executor, request)
+
+    if response.streaming and django.VERSION >= (4, 2) and not getattr(response, 'is_async', False):
+        response.streaming_content = _iterate_in_executor(response.streaming_content, executor)
+    return response
+
+
+elfinder_connector_async.csrf_exempt = True
+
+
+@login_required
+def elfinder_thumbnail(request, target):
+    elf = get_connector()
+    tmb = elf.thumbnail(target)
+
+    if tmb is None:
+        raise Http404('Thumbnail not found')
 
-    return HttpResponse(json.dumps(response), content_type='application/json')
+    response = FileResponse(open(tmb, 'rb'), content_type=elf.thumbnail_mimetype())
+    # thumbnail URLs carry the image state, so they never change
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
@@ -0,0 +1,53 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from cked.elf.utils import make_hash
+
+
+class ConnectorTestCase(TestCase):
+    """ Connector requests made by a logged in user against a temporary root. """
+
+    options = {}
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='cked-')
+        self.addCleanup(shutil.rmtree, self.root, True)
+
+        options = {'root': self.root, 'URL': '/media/', 'debug': True}
+        options.update(self.options)
+        settings = override_settings(ELFINDER_OPTIONS=options)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client.force_login(User.objects.create_user('editor', password='secret'))
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def hash(self, *parts):
+        return make_hash(self.path(*parts)) if parts else make_hash(self.root)
+
+    def write(self, rel, data=b''):
+        path = self.path(rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def request(self, method='get', **params):
+        return getattr(self.client, method)(reverse('cked_elfinder_connector'), params)
+
+    def command(self, cmd, method='get', **params):
+        """ Run connector command, return decoded JSON response. """
+        response = self.request(method, cmd=cmd, **params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content) if response.streaming else response.content)
+
+    def names(self, response):
+        return sorted(entry['name'] for entry in response['cdc'])
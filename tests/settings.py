@@ -0,0 +1,40 @@
+import os
+import tempfile
+
+SECRET_KEY = 'cked-tests'
+
+INSTALLED_APPS = [
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'cked',
+]
+
+MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+]
+
+ROOT_URLCONF = 'tests.urls'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': True,
+    },
+]
+
+STATIC_URL = '/static/'
+
+# tests run with a root of their own, see tests.base
+ELFINDER_OPTIONS = {
+    'root': os.path.join(tempfile.gettempdir(), 'cked-tests'),
+    'URL': '/media/',
+}
@@ -0,0 +1,139 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase
+
+from cked.elf.chunks import ChunkedUpload, purge_stale
+
+from .base import ConnectorTestCase
+
+DATA = b'0123456789'
+PARTS = [(0, 4), (4, 4), (8, 2)]
+
+
+class ChunkedUploadTests(ConnectorTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.command('open', target=self.hash())
+
+    def send(self, index, byte_range, data=None, count=len(PARTS), cid='1'):
+        params = {'current': self.hash(), 'chunk': f'big.bin.{index}_{count - 1}.part', 'cid': cid,
+                  'range': ','.join(str(n) for n in byte_range)}
+        if data is not None:
+            params['upload[]'] = SimpleUploadedFile(params['chunk'], data, 'application/octet-stream')
+        return self.command('upload', method='post', **params)
+
+    def send_part(self, index, **kwargs):
+        start, length = PARTS[index]
+        return self.send(index, (start, length, len(DATA)), DATA[start:start + length], **kwargs)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def test_parts_in_any_order(self):
+        self.assertEqual(self.send_part(2)['chunks'], [2])
+        self.assertEqual(self.send_part(0)['chunks'], [0, 2])
+        self.assertFalse(os.path.exists(self.path('big.bin')))
+
+        response = self.send_part(1)
+        self.assertNotIn('error', response)
+        self.assertEqual(response['select'], [self.hash('big.bin')])
+        self.assertIn('big.bin', self.names(response))
+        self.assertEqual(self.read('big.bin'), DATA)
+        self.assertEqual(os.listdir(self.path('.chunks')), [])
+
+    def test_resume_reports_received_parts(self):
+        self.send_part(1)
+        response = self.send(0, (0, 4, len(DATA)))
+        self.assertNotIn('error', response)
+        self.assertEqual(response['chunks'], [1])
+
+        # another upload of the same file is kept apart
+        self.assertEqual(self.send(0, (0, 4, len(DATA)), cid='2')['chunks'], [])
+
+        self.send_part(0)
+        self.send_part(2)
+        self.assertEqual(self.read('big.bin'), DATA)
+
+    def test_part_shorter_than_its_range(self):
+        response = self.send(0, (0, 4, len(DATA)), DATA[:3])
+        self.assertEqual(response['error'], "Chunk size does not match its range")
+
+        response = self.send(0, (0, 4, len(DATA)))
+        self.assertEqual(response['chunks'], [])
+
+    def test_parts_not_adding_up_to_total(self):
+        self.send(0, (0, 4, len(DATA)), DATA[:4], count=2)
+        response = self.send(1, (4, 4, len(DATA)), DATA[4:8], count=2)
+        self.assertEqual(response['error'], "Uploaded chunks do not match the file size")
+        self.assertFalse(os.path.exists(self.path('big.bin')))
+        self.assertEqual(os.listdir(self.path('.chunks')), [])
+
+    def test_invalid_chunk_parameters(self):
+        for chunk, byte_range in (('big.bin', '0,4,10'), ('big.bin.3_2.part', '0,4,10'),
+                                  ('big.bin.0_2.part', '8,4,10'), ('big.bin.0_2.part', 'x')):
+            with self.subTest(chunk=chunk, range=byte_range):
+                response = self.command('upload', method='post', current=self.hash(), chunk=chunk, cid='1',
+                                        range=byte_range)
+                self.assertIn('error', response)
+
+
+class AssembleTests(SimpleTestCase):
+
+    def make_dir(self):
+        path = tempfile.mkdtemp(prefix='cked-')
+        self.addCleanup(shutil.rmtree, path, True)
+        return path
+
+    def test_one_of_racing_requests_assembles(self):
+        for _ in range(20):
+            with self.subTest():
+                self.race()
+
+    def race(self):
+        base = Path(self.make_dir())
+        upload = ChunkedUpload(base.joinpath('.chunks'), 'key', len(PARTS), len(DATA))
+        for index, (start, length) in enumerate(PARTS):
+            self.assertTrue(upload.write(index, start, io.BytesIO(DATA[start:start + length]), length))
+
+        barrier = threading.Barrier(2)
+        results = []
+
+        def assemble():
+            barrier.wait()
+            results.append(ChunkedUpload(base.joinpath('.chunks'), 'key', len(PARTS), len(DATA))
+                           .assemble(base.joinpath('big.bin'), 0o644))
+
+        threads = [threading.Thread(target=assemble) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), [False, True])
+        self.assertEqual(base.joinpath('big.bin').read_bytes(), DATA)
+        self.assertEqual(oct(base.joinpath('big.bin').stat().st_mode & 0o777), oct(0o644))
+
+    def test_purge_stale(self):
+        base = Path(self.make_dir())
+        old = time.time() - 7200
+        for name in ('old-upload', 'new-upload'):
+            base.joinpath(name).mkdir()
+            base.joinpath(name, 'data').write_bytes(DATA)
+        for name in ('old.tmp', 'new.tmp'):
+            base.joinpath(name).write_bytes(DATA)
+        for name in ('old-upload', 'old.tmp'):
+            os.utime(base.joinpath(name), (old, old))
+
+        purge_stale(base, 3600)
+        self.assertEqual(sorted(os.listdir(base)), ['new-upload', 'new.tmp'])
+
+        purge_stale(base.joinpath('missing'), 3600)
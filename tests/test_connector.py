@@ -0,0 +1,333 @@
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from cked.elf.index import Index
+from cked.elf.thumbs import get_scheduler
+from cked.elf.utils import make_hash
+from cked.views import elfinder_connector, elfinder_connector_async
+
+from .base import ConnectorTestCase
+
+
+class HashLookupTests(ConnectorTestCase):
+
+    def test_malformed_hash_is_not_found_without_rebuild(self):
+        with mock.patch.object(Index, 'rebuild', autospec=True, side_effect=Index.rebuild) as rebuild:
+            response = self.command('open', target='../../etc')
+        self.assertEqual(response['error'], "Invalid parameters")
+        self.assertEqual(rebuild.call_count, 0)
+
+    def test_unknown_hashes_rebuild_index_once_per_interval(self):
+        os.makedirs(self.path('outside'))
+
+        with mock.patch.object(Index, 'rebuild', autospec=True, side_effect=Index.rebuild) as rebuild:
+            response = self.command('open', target=self.hash('outside'))
+            self.assertEqual(response['cwd']['name'], 'outside')
+
+            for _ in range(3):
+                response = self.command('open', target=make_hash(self.path('missing')))
+                self.assertEqual(response['error'], "Invalid parameters")
+
+        self.assertEqual(rebuild.call_count, 1)
+
+
+class TreeIndexTests(ConnectorTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(self.path('a', 'sub', 'deeper'))
+        self.command('open', target=self.hash())
+
+    def test_subfolders_of_renamed_folder_can_be_opened(self):
+        response = self.command('rename', current=self.hash(), target=self.hash('a'), name='b', tree='1')
+        self.assertNotIn('error', response)
+
+        for parts in (('b', 'sub'), ('b', 'sub', 'deeper')):
+            response = self.command('open', target=self.hash(*parts))
+            self.assertEqual(response['cwd']['name'], parts[-1])
+
+    def test_subfolders_of_copied_folder_can_be_opened(self):
+        response = self.command('duplicate', current=self.hash(), target=self.hash('a'))
+        self.assertNotIn('error', response)
+
+        response = self.command('open', target=self.hash('a copy', 'sub', 'deeper'))
+        self.assertEqual(response['cwd']['name'], 'deeper')
+
+    def test_folders_made_outside_are_found_through_tree(self):
+        # used up by the first open
+        self.assertFalse(Index(self.path('.elfinder.sqlite3'), self.root).claim_rebuild(300))
+        os.makedirs(self.path('uploads', '2024', '05'))
+
+        self.command('open', target=self.hash(), tree='1')
+        response = self.command('open', target=self.hash('uploads', '2024', '05'))
+        self.assertEqual(response['cwd']['name'], '05')
+
+    def test_rebuild_skips_dot_folders(self):
+        os.makedirs(self.path('.tmb', 'ab', 'cd'))
+        index = Index(self.path('.elfinder.sqlite3'), self.root)
+        self.assertEqual(index.rebuild(), 4)
+        self.assertIsNone(index.get(make_hash(self.path('.tmb', 'ab'))))
+        self.assertEqual(index.get(self.hash('a', 'sub', 'deeper')), Path(self.path('a', 'sub', 'deeper')))
+        index.close()
+
+
+class EditTests(ConnectorTestCase):
+
+    def test_edit_reports_new_size(self):
+        self.write('notes.txt', b'x')
+
+        response = self.command(
+            'edit', method='post', current=self.hash(), target=self.hash('notes.txt'), content='hello world'
+        )
+
+        self.assertNotIn('error', response)
+        self.assertEqual(response['target']['size'], len('hello world'))
+        with open(self.path('notes.txt')) as f:
+            self.assertEqual(f.read(), 'hello world')
+
+
+class OpenFileTests(ConnectorTestCase):
+
+    def open_file(self, name):
+        self.command('open', target=self.hash())
+        response = self.request(current=self.hash(), target=self.hash(name), cmd='open')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_non_ascii_name_is_encoded(self):
+        self.write('отчёт 2024.pdf', b'%PDF')
+        response = self.open_file('отчёт 2024.pdf')
+        self.assertEqual(
+            response['Content-Disposition'],
+            "attachment; filename*=utf-8''%D0%BE%D1%82%D1%87%D1%91%D1%82%202024.pdf"
+        )
+        self.assertEqual(response['Content-Location'], '/media/%D0%BE%D1%82%D1%87%D1%91%D1%82%202024.pdf')
+
+    def test_missing_file_is_not_found(self):
+        response = self.request(current=self.hash(), target=self.hash('missing.pdf'), cmd='open')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content), "File not found")
+
+    def test_images_are_shown_inline(self):
+        self.write('a "b".png', b'')
+        response = self.open_file('a "b".png')
+        self.assertEqual(response['Content-Disposition'], 'inline; filename="a \\"b\\".png"')
+
+
+class ListingCacheTests(ConnectorTestCase):
+
+    options = {'listingCache': 'default', 'tmbOnDemand': True}
+
+    def test_listing_after_rebuild_registers_entries(self):
+        Image.new('RGB', (10, 10)).save(self.path('cached.png'))
+        first = self.command('open', target=self.hash())
+
+        # drops the files, another process may do it at any time
+        index = Index(self.path('.elfinder.sqlite3'), self.root)
+        index.rebuild()
+        self.assertIsNone(index.get(self.hash('cached.png')))
+        second = self.command('open', target=self.hash())
+        self.assertEqual(second['cdc'], first['cdc'])
+        self.assertIsNotNone(index.get(self.hash('cached.png')))
+        index.close()
+
+        response = self.client.get(reverse('cked_elfinder_thumbnail', kwargs={'target': self.hash('cached.png')}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_cache_hit_does_not_write_index(self):
+        for n in range(50):
+            self.write(f'{n}.txt')
+        first = self.command('open', target=self.hash())
+
+        with mock.patch.object(Index, 'add_many', autospec=True) as add_many:
+            second = self.command('open', target=self.hash())
+        self.assertEqual(second['cdc'], first['cdc'])
+        self.assertEqual(add_many.call_count, 0)
+
+
+class ConcurrencyTests(ConnectorTestCase):
+
+    def test_interleaved_open_of_different_directories(self):
+        folders = [f'folder{i}' for i in range(6)]
+        expected = {}
+        for folder in folders:
+            names = [f'{folder}-{n}.txt' for n in range(20)]
+            for name in names:
+                self.write(os.path.join(folder, name))
+            expected[folder] = sorted(names)
+        # resolve the hashes once, so the threads only list
+        self.command('open', target=self.hash())
+
+        user = User.objects.get(username='editor')
+        factory = RequestFactory()
+        barrier = threading.Barrier(len(folders))
+        results = {folder: [] for folder in folders}
+        errors = []
+
+        def run(folder):
+            try:
+                barrier.wait()
+                for _ in range(15):
+                    request = factory.get('/', {'cmd': 'open', 'target': self.hash(folder)})
+                    request.user = user
+                    response = json.loads(elfinder_connector(request).content)
+                    results[folder].append((response['cwd']['name'], self.names(response)))
+            except Exception as exc:  # pylint: disable=broad-except
+                errors.append(exc)
+
+        threads = [threading.Thread(target=run, args=(folder,)) for folder in folders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for folder in folders:
+            self.assertEqual(len(results[folder]), 15)
+            for name, names in results[folder]:
+                self.assertEqual(name, folder)
+                self.assertEqual(names, expected[folder])
+
+
+class StartupTests(SimpleTestCase):
+
+    def test_ready_does_not_touch_root(self):
+        root = os.path.join(tempfile.gettempdir(), 'cked-missing-parent', 'uploads')
+        config = apps.get_app_config('cked')
+        with override_settings(ELFINDER_OPTIONS={'root': root, 'URL': '/media/'}):
+            config.ready()
+            self.assertIsNone(config._connector)
+        self.assertFalse(os.path.exists(os.path.dirname(root)))
+
+    def test_index_connects_on_first_use(self):
+        with tempfile.TemporaryDirectory() as root:
+            index = Index(os.path.join(root, 'missing', 'index.sqlite3'), root)
+            with self.assertRaises(sqlite3.Error):
+                index.open()
+
+            index = Index(os.path.join(root, 'index.sqlite3'), root)
+            self.assertFalse(os.path.exists(index.db_path))
+            conn = index._connect()
+            self.assertIs(index._connect(), conn)
+            with mock.patch('cked.elf.index.os.getpid', return_value=os.getpid() + 1):
+                # forked child
+                child = index._connect()
+            self.assertIsNot(child, conn)
+            conn.close()
+            child.close()
+
+
+class AsyncViewTests(ConnectorTestCase):
+
+    def test_database_connections_of_executor_threads_are_closed(self):
+        request = RequestFactory().get('/', {'cmd': 'open', 'target': self.hash()})
+        request.user = User.objects.get(username='editor')
+        threads = []
+
+        with mock.patch('cked.views.close_old_connections', lambda: threads.append(threading.current_thread().name)):
+            response = async_to_sync(elfinder_connector_async)(request)
+
+        self.assertEqual(json.loads(response.content)['cwd']['hash'], self.hash())
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith('cked') for name in threads))
+
+
+class ImageProcessingTests(ConnectorTestCase):
+
+    options = {'uploadImageProcess': True, 'uploadImageMaxSize': 64}
+
+    def folder_size(self, response, name):
+        return next(entry['size'] for entry in response['cdc'] if entry['name'] == name)
+
+    def test_processed_upload_updates_ancestor_sizes(self):
+        os.makedirs(self.path('photos', '2024'))
+        self.command('open', target=self.hash())
+
+        image = io.BytesIO()
+        Image.effect_noise((400, 300), 64).save(image, 'PNG')
+        upload = SimpleUploadedFile('noise.png', image.getvalue(), 'image/png')
+        self.command('upload', method='post', current=self.hash('photos', '2024'), **{'upload[]': upload})
+        # size of the folder as uploaded, before the worker process shrinks the image
+        self.command('open', target=self.hash())
+
+        scheduler = get_scheduler(self.options.get('tmbWorkers', 2))
+        deadline = time.monotonic() + 30
+        while scheduler.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(scheduler.pending(), 0)
+
+        size = os.path.getsize(self.path('photos', '2024', 'noise.png'))
+        self.assertLess(size, len(image.getvalue()))
+        self.assertEqual(self.folder_size(self.command('open', target=self.hash()), 'photos'), size)
+
+
+class DedupTests(ConnectorTestCase):
+
+    options = {'dedup': True}
+
+    def setUp(self):
+        super().setUp()
+        for folder in ('a', 'b'):
+            os.makedirs(self.path(folder))
+        self.command('open', target=self.hash())
+        for folder in ('a', 'b'):
+            upload = SimpleUploadedFile('same.txt', b'shared content', 'text/plain')
+            self.command('upload', method='post', current=self.hash(folder), **{'upload[]': upload})
+        self.assertEqual(os.stat(self.path('a', 'same.txt')).st_nlink, 3)
+
+    def edit(self, *parts):
+        response = self.command(
+            'edit', method='post', current=self.hash(*parts[:-1]), target=self.hash(*parts), content='changed'
+        )
+        self.assertNotIn('error', response)
+
+    def read(self, *parts):
+        with open(self.path(*parts), 'rb') as f:
+            return f.read()
+
+    def blobs(self):
+        return [name for _, _, names in os.walk(self.path('.blobs')) for name in names]
+
+    def test_edit_of_renamed_file_keeps_twin(self):
+        self.command('open', target=self.hash('a'))
+        self.command('rename', current=self.hash('a'), target=self.hash('a', 'same.txt'), name='renamed.txt')
+
+        self.edit('a', 'renamed.txt')
+        self.assertEqual(self.read('a', 'renamed.txt'), b'changed')
+        self.assertEqual(self.read('b', 'same.txt'), b'shared content')
+        self.assertEqual(os.stat(self.path('b', 'same.txt')).st_nlink, 2)
+
+    def test_removing_moved_files_drops_blob(self):
+        for folder in ('a', 'b'):
+            os.makedirs(self.path(f'{folder}-moved'))
+        self.command('open', target=self.hash())
+        for folder in ('a', 'b'):
+            self.command('paste', current=self.hash(folder), src=self.hash(folder), dst=self.hash(f'{folder}-moved'),
+                         cut='1', **{'targets[]': [self.hash(folder, 'same.txt')]})
+
+        for folder in ('a-moved', 'b-moved'):
+            self.command('rm', current=self.hash(folder), **{'targets[]': [self.hash(folder, 'same.txt')]})
+        self.assertEqual(self.blobs(), [])
+
+    def test_edit_of_file_moved_on_disk_keeps_twin(self):
+        os.rename(self.path('a', 'same.txt'), self.path('a', 'moved.txt'))
+        self.command('open', target=self.hash('a'))
+
+        self.edit('a', 'moved.txt')
+        self.assertEqual(self.read('b', 'same.txt'), b'shared content')
+        self.assertEqual(os.stat(self.path('b', 'same.txt')).st_nlink, 2)
@@ -0,0 +1,133 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+from cked.elf.connector import Connector
+from cked.elf.jobs import JOB_DONE, JobStore, get_job_pool
+
+from .base import ConnectorTestCase
+
+
+class JobTests(ConnectorTestCase):
+
+    options = {'jobs': True, 'jobsTimeout': 3600}
+
+    def setUp(self):
+        super().setUp()
+        for n in range(5):
+            self.write(f'folder/{n}.txt', b'x')
+        self.command('open', target=self.hash())
+        self.store = JobStore(self.path('.elfinder-jobs.sqlite3'))
+        self.addCleanup(self.store.close)
+
+    def rm(self, *parts):
+        response = self.command('rm', current=self.hash(*parts[:-1]), **{'targets[]': [self.hash(*parts)]})
+        self.assertEqual(response['job']['cmd'], 'rm')
+        return response['job']['id']
+
+    def status(self, job_id):
+        return self.command('status', job=job_id)
+
+    def wait(self, job_id):
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            response = self.status(job_id)
+            if response['job']['state'] in ('done', 'failed'):
+                return response
+            time.sleep(0.02)
+        self.fail(f"job {job_id} did not finish")
+
+    def test_job_goes_from_queued_to_done(self):
+        started, release = threading.Event(), threading.Event()
+        remove = Connector._remove
+
+        def blocking_remove(connector, target):
+            started.set()
+            release.wait(30)
+            return remove(connector, target)
+
+        with mock.patch.object(Connector, '_remove', blocking_remove):
+            job_id = self.rm('folder')
+            self.assertTrue(started.wait(30))
+            response = self.status(job_id)
+            self.assertEqual(response['job']['state'], 'running')
+            self.assertEqual(response['job']['total'], 5)
+            self.assertEqual(response['job']['done'], 0)
+            self.assertNotIn('cdc', response)
+            release.set()
+            response = self.wait(job_id)
+
+        self.assertEqual(response['job']['state'], 'done')
+        self.assertEqual((response['job']['done'], response['job']['total']), (5, 5))
+        self.assertEqual(response['job']['errors'], {})
+        self.assertEqual(self.names(response), [])
+        self.assertFalse(os.path.exists(self.path('folder')))
+
+    def test_job_is_queued_until_a_worker_is_free(self):
+        release = threading.Event()
+        pool = get_job_pool(2)
+        busy = [pool.submit(release.wait, 30) for _ in range(2)]
+
+        job_id = self.rm('folder', '0.txt')
+        response = self.status(job_id)
+        self.assertEqual(response['job']['state'], 'queued')
+        self.assertEqual((response['job']['done'], response['job']['total']), (0, 0))
+
+        release.set()
+        for future in busy:
+            future.result(30)
+        response = self.wait(job_id)
+        self.assertEqual(response['job']['state'], 'done')
+        self.assertEqual((response['job']['done'], response['job']['total']), (1, 1))
+
+    def test_errors_are_reported_per_file_relative_to_root(self):
+        unlink = Path.unlink
+
+        def failing_unlink(path, *args, **kwargs):
+            if path.name == '3.txt':
+                raise PermissionError(13, 'Permission denied')
+            return unlink(path, *args, **kwargs)
+
+        with mock.patch.object(Path, 'unlink', failing_unlink):
+            response = self.wait(self.rm('folder'))
+
+        self.assertEqual(response['job']['state'], 'done')
+        self.assertEqual(response['job']['errors'], {
+            os.path.join('folder', '3.txt'): "Remove failed",
+            'folder': "Access denied",
+        })
+        self.assertEqual(os.listdir(self.path('folder')), ['3.txt'])
+
+    def test_job_of_exited_process_is_failed(self):
+        process = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                                 capture_output=True, check=True, text=True)
+        job_id = self.store.create('rm', 3600)
+        self.store._connect().execute("UPDATE jobs SET pid = ? WHERE id = ?", (int(process.stdout), job_id))
+
+        response = self.status(job_id)
+        self.assertEqual(response['job']['state'], 'failed')
+        self.assertEqual(response['job']['errors'], {'': "Interrupted"})
+
+    def test_finished_jobs_expire(self):
+        old_id = self.store.create('rm', 3600)
+        self.store.finish(old_id, JOB_DONE, 1, {}, None)
+        self.store._connect().execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time() - 7200, old_id))
+        running_id = self.store.create('rm', 3600)
+        self.store._connect().execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time() - 7200, running_id))
+
+        # the next job drops what is older than jobsTimeout
+        self.wait(self.rm('folder', '0.txt'))
+        self.assertEqual(self.status(old_id)['error'], "Invalid parameters")
+        self.assertEqual(self.status(running_id)['job']['state'], 'queued')
+
+    def test_unknown_job(self):
+        for job_id in ('0' * 32, 'not-a-job'):
+            with self.subTest(job=job_id):
+                response = self.status(job_id)
+                self.assertEqual(response['error'], "Invalid parameters")
+                self.assertNotIn('job', response)
+        self.assertEqual(self.command('status')['error'], "Invalid parameters")
@@ -0,0 +1,136 @@
+import os
+
+from django.test import SimpleTestCase
+
+from cked.elf.utils import _b64encode, decode_path_id, encode_path_id, make_hash
+
+from .base import ConnectorTestCase
+
+SECRET = 'path-id-secret'
+
+
+class PathIdTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        for rel in ('', 'a', os.path.join('a', 'b c'), os.path.join('ünï', 'кот.txt')):
+            with self.subTest(rel=rel):
+                path_id = encode_path_id(rel, SECRET)
+                self.assertTrue(path_id.startswith('l1_'))
+                self.assertRegex(path_id, r'^[A-Za-z0-9_.-]+$')
+                self.assertEqual(decode_path_id(path_id, SECRET), rel.replace(os.sep, '/'))
+
+    def test_tampered_signature(self):
+        path_id = encode_path_id('a/b', SECRET)
+        encoded, signature = path_id.rsplit('.', 1)
+        tampered = signature[:-1] + ('A' if signature[-1] != 'A' else 'B')
+        self.assertIsNone(decode_path_id(f'{encoded}.{tampered}', SECRET))
+        self.assertIsNone(decode_path_id(encoded, SECRET))
+        self.assertIsNone(decode_path_id(path_id, 'other-secret'))
+
+    def test_tampered_path(self):
+        signature = encode_path_id('a/b', SECRET).rsplit('.', 1)[1]
+        forged = f"l1_{_b64encode(b'../etc')}.{signature}"
+        self.assertIsNone(decode_path_id(forged, SECRET))
+        self.assertIsNone(decode_path_id('l1_!!!.' + signature, SECRET))
+
+    def test_unsafe_components_are_refused_even_when_signed(self):
+        for rel in ('..', '../etc', 'a/../../etc', 'a/./b', 'a//b', 'a/', '/etc/passwd', 'a\0b', '.'):
+            with self.subTest(rel=rel):
+                self.assertIsNone(decode_path_id(encode_path_id(rel, SECRET), SECRET))
+
+    def test_wrong_prefix(self):
+        path_id = encode_path_id('a', SECRET)
+        self.assertIsNone(decode_path_id('l2_' + path_id[3:], SECRET))
+        self.assertIsNone(decode_path_id(path_id[3:], SECRET))
+        self.assertEqual(decode_path_id(encode_path_id('a', SECRET, 'v2_'), SECRET, 'v2_'), 'a')
+
+
+class PathModeConnectorTests(ConnectorTestCase):
+
+    options = {'hashMode': 'path', 'hashSecret': SECRET}
+
+    def hash(self, *parts):
+        return encode_path_id('/'.join(parts), SECRET)
+
+    def test_identifiers_of_listing_and_tree_decode_to_their_paths(self):
+        os.makedirs(self.path('docs', 'sub'))
+        self.write('docs/readme.txt')
+        self.write('top.txt')
+
+        response = self.command('open', target=self.hash(), tree='1')
+        self.assertEqual(decode_path_id(response['cwd']['hash'], SECRET), '')
+        for entry in response['cdc']:
+            self.assertEqual(decode_path_id(entry['hash'], SECRET), entry['name'])
+        docs = next(node for node in response['tree']['dirs'] if node['name'] == 'docs')
+        self.assertEqual(docs['hash'], self.hash('docs'))
+        self.assertEqual(decode_path_id(docs['dirs'][0]['hash'], SECRET), 'docs/sub')
+
+        response = self.command('open', target=docs['hash'])
+        self.assertEqual(response['cwd']['name'], 'docs')
+        self.assertEqual(self.names(response), ['readme.txt', 'sub'])
+        hashes = {entry['name']: entry['hash'] for entry in response['cdc']}
+        self.assertEqual(hashes['readme.txt'], self.hash('docs', 'readme.txt'))
+
+    def test_forged_and_unsafe_identifiers_are_refused(self):
+        os.makedirs(self.path('docs'))
+        signature = self.hash('docs').rsplit('.', 1)[1]
+        for target in (
+            f"l1_{_b64encode(b'docs')}.x{signature}",
+            f"l1_{_b64encode(b'..')}.{signature}",
+            encode_path_id('docs', 'other-secret'),
+            encode_path_id('..', SECRET),
+            encode_path_id(os.path.dirname(self.root), SECRET),
+            make_hash(self.path('docs')),
+        ):
+            with self.subTest(target=target):
+                response = self.command('open', target=target)
+                self.assertEqual(response['error'], "Invalid parameters")
+                self.assertEqual(response['cwd']['hash'], self.hash())
+
+    def test_symlinked_directory_is_not_opened(self):
+        outside = self.path('..', os.path.basename(self.root) + '-outside')
+        os.makedirs(outside)
+        self.addCleanup(os.rmdir, outside)
+        os.makedirs(self.path('real'))
+        os.symlink(outside, self.path('escape'))
+        os.symlink(self.path('real'), self.path('alias'))
+
+        for name in ('escape', 'alias'):
+            with self.subTest(name=name):
+                response = self.command('open', target=self.hash(name))
+                self.assertEqual(response['error'], "Invalid parameters")
+        self.assertEqual(self.command('open', target=self.hash('real'))['cwd']['name'], 'real')
+
+    def test_target_outside_current_folder_is_not_found(self):
+        os.makedirs(self.path('a'))
+        self.write('a/keep.txt', b'keep')
+
+        self.command('rm', current=self.hash(), **{'targets[]': [self.hash('a', 'keep.txt')]})
+        self.assertTrue(os.path.exists(self.path('a', 'keep.txt')))
+
+        response = self.request(current=self.hash(), target=self.hash('a', 'keep.txt'), cmd='open')
+        self.assertEqual(response.status_code, 404)
+
+        self.command('rm', current=self.hash('a'), **{'targets[]': [self.hash('a', 'keep.txt')]})
+        self.assertFalse(os.path.exists(self.path('a', 'keep.txt')))
+
+
+    def test_file_links_are_followed_only_inside_root(self):
+        outside = self.path('..', os.path.basename(self.root) + '-secret.txt')
+        with open(outside, 'wb') as f:
+            f.write(b'secret')
+        self.addCleanup(os.unlink, outside)
+        self.write('real.txt', b'public')
+        os.symlink(outside, self.path('escape.txt'))
+        os.symlink(self.path('real.txt'), self.path('alias.txt'))
+
+        response = self.command('open', target=self.hash())
+        mimes = {entry['name']: entry['mime'] for entry in response['cdc']}
+        self.assertEqual(mimes['escape.txt'], 'symlink-broken')
+        self.assertEqual(mimes['alias.txt'], 'text/plain')
+
+        response = self.request(current=self.hash(), target=self.hash('escape.txt'), cmd='open')
+        self.assertEqual(response.status_code, 404)
+        response = self.request(current=self.hash(), target=self.hash('alias.txt'), cmd='open')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'public')
@@ -0,0 +1,124 @@
+from django.test import SimpleTestCase
+from django.urls import reverse
+
+from cked.responses import parse_range
+
+from .base import ConnectorTestCase
+
+DATA = b'0123456789'
+
+
+class ParseRangeTests(SimpleTestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=2-5', 10), (2, 5))
+        self.assertEqual(parse_range('bytes=7-', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(parse_range('bytes=-30', 10), (0, 9))
+        self.assertEqual(parse_range('bytes=5-50', 10), (5, 9))
+        self.assertIs(parse_range('bytes=10-', 10), False)
+        self.assertIs(parse_range('bytes=-0', 10), False)
+        for header in ('bytes=5-2', 'bytes=-', 'bytes=0-1,3-4', 'items=0-1'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 10))
+
+
+class DownloadTestCase(ConnectorTestCase):
+    """ Downloads of docs/digits.txt through the open command. """
+
+    def setUp(self):
+        super().setUp()
+        self.write('docs/digits.txt', DATA)
+        self.command('open', target=self.hash('docs'))
+
+    def download(self, **headers):
+        return self.client.get(
+            reverse('cked_elfinder_connector'),
+            {'cmd': 'open', 'current': self.hash('docs'), 'target': self.hash('docs', 'digits.txt')},
+            **headers
+        )
+
+    def body(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+
+class FileResponseTests(DownloadTestCase):
+
+    def test_full_download(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), DATA)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+
+    def test_satisfiable_range(self):
+        response = self.download(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+        self.assertEqual(self.body(response), b'2345')
+
+    def test_suffix_and_open_ended_ranges(self):
+        for header, content_range, body in (('bytes=-3', 'bytes 7-9/10', b'789'),
+                                            ('bytes=6-', 'bytes 6-9/10', b'6789')):
+            with self.subTest(header=header):
+                response = self.download(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response['Content-Range'], content_range)
+                self.assertEqual(self.body(response), body)
+
+    def test_unsatisfiable_range(self):
+        response = self.download(HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_if_none_match(self):
+        etag = self.download()['ETag']
+        response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_if_range_with_stale_etag_sends_whole_file(self):
+        etag = self.download()['ETag']
+        response = self.download(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+
+        response = self.download(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), DATA)
+
+
+class SendfileTests(DownloadTestCase):
+
+    options = {'sendfile': 'X-Sendfile'}
+
+    def test_server_sends_file_and_ranges(self):
+        response = self.download(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Sendfile'], self.path('docs', 'digits.txt'))
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertNotIn('Content-Range', response)
+        self.assertEqual(self.body(response), b'')
+
+    def test_if_none_match(self):
+        etag = self.download()['ETag']
+        self.assertEqual(self.download(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class AccelRedirectTests(DownloadTestCase):
+
+    options = {'sendfile': 'X-Accel-Redirect', 'sendfileURL': '/protected/'}
+
+    def test_internal_location_of_file(self):
+        self.write('docs/a b ü.txt', DATA)
+        self.command('open', target=self.hash('docs'))
+
+        response = self.client.get(
+            reverse('cked_elfinder_connector'),
+            {'cmd': 'open', 'current': self.hash('docs'), 'target': self.hash('docs', 'a b ü.txt')}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/docs/a%20b%20%C3%BC.txt')
+        self.assertNotIn('X-Sendfile', response)
+        self.assertEqual(self.body(response), b'')
@@ -0,0 +1,216 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from cked.elf.thumbs import ThumbnailScheduler, _save_temp, make_thumbnail, process_image
+from cked.views import build_connector
+
+from .base import ConnectorTestCase
+
+
+class ThumbnailTests(ConnectorTestCase):
+
+    def make_images(self):
+        """ Images larger than twice the thumbnail size in modes reduce() does not take """
+        palette = Image.effect_noise((400, 300), 64).convert('RGB').quantize(16)
+        palette.save(self.path('palette.png'))
+        palette.save(self.path('animation.gif'))
+        transparent = palette.copy()
+        transparent.info['transparency'] = 0
+        transparent.save(self.path('transparent.png'))
+        Image.linear_gradient('L').resize((400, 300)).convert('I;16').save(self.path('deep.png'))
+        Image.new('1', (400, 300), 1).save(self.path('bilevel.png'))
+        return ['palette.png', 'animation.gif', 'transparent.png', 'deep.png', 'bilevel.png']
+
+    def test_make_thumbnail_of_every_mode(self):
+        for name in self.make_images():
+            with self.subTest(name=name):
+                tmb_path = self.path('.tmb', f'{name}.png')
+                self.assertTrue(make_thumbnail(self.path(name), tmb_path, 48))
+                with Image.open(tmb_path) as tmb:
+                    self.assertEqual(tmb.size, (48, 48))
+                    self.assertIn(tmb.mode, ('RGB', 'RGBA', 'L', 'LA'))
+
+    def test_high_bit_depth_thumbnail_keeps_contrast(self):
+        self.make_images()
+        tmb_path = self.path('.tmb', 'deep.png')
+        make_thumbnail(self.path('deep.png'), tmb_path, 48)
+        with Image.open(tmb_path) as tmb:
+            low, high = tmb.getextrema()
+        self.assertLess(low, 32)
+        self.assertGreater(high, 224)
+
+    def test_tmb_command_creates_palette_thumbnails(self):
+        names = self.make_images()
+        response = self.command('tmb', current=self.hash())
+        self.assertEqual(sorted(response['images']), sorted(self.hash(name) for name in names))
+
+    def test_concurrent_thumbnails_of_same_image(self):
+        self.make_images()
+        tmb_path = self.path('.tmb', 'shared.png')
+        errors = []
+
+        def run():
+            try:
+                for _ in range(10):
+                    make_thumbnail(self.path('palette.png'), tmb_path, 48)
+            except Exception as exc:  # pylint: disable=broad-except
+                errors.append(exc)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with Image.open(tmb_path) as tmb:
+            tmb.load()
+        self.assertEqual(os.listdir(os.path.dirname(tmb_path)), ['shared.png'])
+
+
+class OnDemandThumbnailTests(ConnectorTestCase):
+
+    options = {'tmbOnDemand': True}
+
+    def test_thumbnail_view_finds_image_through_index(self):
+        Image.new('RGB', (200, 100), 'red').save(self.path('red.png'))
+        self.command('open', target=self.hash())
+
+        response = self.client.get(reverse('cked_elfinder_thumbnail', kwargs={'target': self.hash('red.png')}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+    def test_md5_hashes_without_index_are_refused(self):
+        with override_settings(ELFINDER_OPTIONS={'root': self.root, 'URL': '/media/', 'tmbOnDemand': True,
+                                                 'index': ''}):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'tmbOnDemand'):
+                build_connector()
+
+
+class SchedulerTests(SimpleTestCase):
+
+    def test_workers_are_not_forked_from_request_threads(self):
+        scheduler = ThumbnailScheduler(1)
+        self.addCleanup(scheduler.shutdown)
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'red.png')
+            tmb_path = os.path.join(root, '.tmb', 'red.png')
+            Image.new('RGB', (200, 100), 'red').save(path)
+
+            self.assertTrue(scheduler.submit(path, tmb_path, 48))
+            deadline = time.monotonic() + 60
+            while scheduler.pending() and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertFalse(scheduler.failed(tmb_path))
+            self.assertNotEqual(scheduler._executor._mp_context.get_start_method(), 'fork')
+            with Image.open(tmb_path) as tmb:
+                self.assertEqual(tmb.size, (48, 48))
+
+
+class UploadThumbnailTests(ConnectorTestCase):
+
+    options = {'tmbBackground': True}
+
+    def upload(self, count=3):
+        files = []
+        for n in range(count):
+            image = io.BytesIO()
+            Image.new('RGB', (300, 200), 'blue').save(image, 'PNG')
+            files.append(SimpleUploadedFile(f'{n}.png', image.getvalue(), 'image/png'))
+        self.command('open', target=self.hash())
+        response = self.command('upload', method='post', current=self.hash(), **{'upload[]': files})
+        self.assertNotIn('error', response)
+
+    def test_upload_queues_thumbnails(self):
+        with mock.patch.object(ThumbnailScheduler, 'submit', autospec=True, return_value=True) as submit, \
+                mock.patch('cked.elf.connector.ensure_thumbnail') as inline:
+            self.upload()
+        self.assertEqual(sorted(os.path.basename(call.args[1]) for call in submit.call_args_list),
+                         ['0.png', '1.png', '2.png'])
+        self.assertEqual(inline.call_count, 0)
+
+    def test_full_queue_makes_thumbnails_in_request(self):
+        with mock.patch.object(ThumbnailScheduler, 'submit', autospec=True, return_value=False), \
+                mock.patch('cked.elf.connector.ensure_thumbnail') as inline:
+            self.upload()
+        self.assertEqual(inline.call_count, 3)
+
+
+class ProcessImageTests(SimpleTestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp(prefix='cked-')
+        self.addCleanup(shutil.rmtree, root, True)
+        self.root = root
+
+    def save(self, name, **options):
+        path = os.path.join(self.root, name)
+        Image.effect_noise((300, 200), 64).convert('RGB').save(path, **options)
+        return path
+
+    def expected(self, path):
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_animations_are_kept(self):
+        frames = [Image.effect_noise((300, 200), 32 + n * 8).convert('RGB') for n in range(6)]
+        for name, options in (('anim.png', {}), ('anim.webp', {'lossless': True})):
+            with self.subTest(name=name):
+                path = os.path.join(self.root, name)
+                frames[0].save(path, save_all=True, append_images=frames[1:], duration=100, **options)
+                original = self.read(path)
+
+                self.assertFalse(process_image(path, max_size=64, expected=self.expected(path)))
+                self.assertEqual(self.read(path), original)
+                with Image.open(path) as im:
+                    self.assertEqual(im.n_frames, 6)
+
+    def test_file_changed_before_processing_is_left_alone(self):
+        path = self.save('photo.jpg', quality=95)
+        expected = self.expected(path)
+        path = self.save('photo.jpg', quality=90)
+        os.utime(path, ns=(expected[1] + 10 ** 9, expected[1] + 10 ** 9))
+        original = self.read(path)
+
+        self.assertFalse(process_image(path, max_size=64, expected=expected))
+        self.assertEqual(self.read(path), original)
+
+        self.assertFalse(process_image(os.path.join(self.root, 'moved.jpg'), max_size=64, expected=expected))
+
+    def test_file_changed_while_processing_is_left_alone(self):
+        path = self.save('photo.jpg', quality=95)
+        expected = self.expected(path)
+
+        def save_temp(im, target, fmt, **options):
+            tmp_path = _save_temp(im, target, fmt, **options)
+            # uploaded again meanwhile
+            with open(target, 'ab') as f:
+                f.write(b'\0')
+            return tmp_path
+
+        with mock.patch('cked.elf.thumbs._save_temp', save_temp):
+            self.assertFalse(process_image(path, max_size=64, expected=expected))
+        with Image.open(path) as im:
+            self.assertEqual(im.size, (300, 200))
+        self.assertEqual([name for name in os.listdir(self.root) if name.endswith('.tmp')], [])
+
+    def test_unchanged_file_is_processed(self):
+        path = self.save('photo.jpg', quality=95)
+        self.assertTrue(process_image(path, max_size=64, expected=self.expected(path)))
+        with Image.open(path) as im:
+            self.assertEqual(max(im.size), 64)